@@ -3,11 +3,12 @@ import librosa
 import librosa.display
 import numpy as np
 import matplotlib.pyplot as plt
+import io
 import os
+import sys
+import tempfile
 import pandas as pd
-from piano_transcription_inference import PianoTranscription, sample_rate
 from mido import MidiFile
-import torch
 
 st.set_page_config(page_title="Chordia V8", layout="wide")
 
@@ -20,9 +21,9 @@ def get_note_name(midi_number):
     name = notes[midi_number % 12]
     return f"{name}{octave}"
 
-def parse_midi_to_list(midi_path):
+def parse_midi_to_list(midi_bytes):
     """Extracts a human-readable list of notes from the generated MIDI."""
-    mid = MidiFile(midi_path)
+    mid = MidiFile(file=io.BytesIO(midi_bytes))
     note_events = []
     current_time = 0
     
@@ -64,18 +65,37 @@ if uploaded_file:
     if st.button("🚀 Run Deep Analysis", type="primary"):
         with st.spinner("AI is listening to every note... This takes 10-30 seconds."):
             try:
-                # Transcription Engine
-                device = 'cuda' if torch.cuda.is_available() else 'cpu'
-                transcriptor = PianoTranscription(device=device)
-                midi_output = "transcription.mid"
-                
-                # Run the model
-                audio, _ = librosa.load(temp_audio, sr=sample_rate, mono=True)
-                transcriptor.transcribe(audio, midi_output)
-                
+                if os.environ.get("CHORDIA_MODEL_SOCKET"):
+                    # The shared model server (latest/model_server.py --piano) keeps the
+                    # piano model loaded once per host; this process never imports torch
+                    latest = os.path.join(os.path.dirname(os.path.abspath(__file__)), "latest")
+                    if latest not in sys.path:
+                        sys.path.insert(0, latest)
+                    import engine
+                    from model_server import PIANO_SAMPLE_RATE
+                    audio, _ = librosa.load(temp_audio, sr=PIANO_SAMPLE_RATE, mono=True)
+                    _, midi_bytes = engine.get_model_client().transcribe_piano(audio)
+                else:
+                    # Transcription Engine (torch is imported only when an analysis runs)
+                    import torch
+                    from piano_transcription_inference import PianoTranscription, sample_rate
+                    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                    transcriptor = PianoTranscription(device=device)
+                    # Per-run temp file, removed once read: the MIDI bytes live in the session
+                    fd, midi_output = tempfile.mkstemp(suffix=".mid", prefix="chordia_")
+                    os.close(fd)
+                    try:
+                        # Run the model
+                        audio, _ = librosa.load(temp_audio, sr=sample_rate, mono=True)
+                        transcriptor.transcribe(audio, midi_output)
+                        with open(midi_output, "rb") as f:
+                            midi_bytes = f.read()
+                    finally:
+                        os.remove(midi_output)
+
                 # Store results in session state
-                st.session_state['midi_ready'] = midi_output
-                st.session_state['note_list'] = parse_midi_to_list(midi_output)
+                st.session_state['midi_ready'] = midi_bytes
+                st.session_state['note_list'] = parse_midi_to_list(midi_bytes)
                 st.success("Analysis Complete!")
                 
             except Exception as e:
@@ -94,20 +114,18 @@ if uploaded_file:
         with col2:
             st.subheader("📥 Export Data")
             # Download MIDI
-            with open(st.session_state['midi_ready'], "rb") as f:
-                st.download_button(
-                    label="⬇️ Download MIDI File",
-                    data=f,
-                    file_name="piano_transcription.mid",
-                    mime="audio/midi",
-                    width='stretch'
-                )
+            st.download_button(
+                label="⬇️ Download MIDI File",
+                data=st.session_state['midi_ready'],
+                file_name="piano_transcription.mid",
+                mime="audio/midi",
+                width='stretch'
+            )
             
-            # Download Text Notes
-            csv = notes_df.to_csv(index=False).encode('utf-8')
+            # Download Text Notes (CSV is only built when the button is clicked)
             st.download_button(
                 label="⬇️ Download Letter Notes (CSV)",
-                data=csv,
+                data=lambda: notes_df.to_csv(index=False).encode('utf-8'),
                 file_name="notes_guide.csv",
                 mime="text/csv",
                 width='stretch'
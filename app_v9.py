@@ -117,8 +117,8 @@ if uploaded_file:
             with open(st.session_state['midi_ready'], "rb") as f:
                 st.download_button("⬇️ Download MIDI", f, "output.mid", width='stretch')
         with btn2:
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button("⬇️ Download Notes/Tabs (CSV)", csv, "tabs.csv", width='stretch')
+            # CSV is only built when the button is clicked
+            st.download_button("⬇️ Download Notes/Tabs (CSV)", lambda: df.to_csv(index=False).encode('utf-8'), "tabs.csv", width='stretch')
 
     # Cleanup (Recommended to do on script exit or after download)
     if os.path.exists(temp_audio):
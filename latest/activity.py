@@ -0,0 +1,242 @@
+"""Silence and low-activity skipping before inference.
+
+Long silences, count-ins, applause and room noise cost the engines as much as
+music does. detect_activity marks the frames worth transcribing from two cheap
+features of the magnitude STFT:
+
+    energy            RMS within `threshold_db` of the loudest frame
+    spectral flatness below `max_flatness` (tonal, not noise-like: applause,
+                      hiss and crowd noise are close to flat)
+
+Short gaps are bridged, short blips dropped and every region padded, so notes
+are not cut at the edges. The active regions are joined (with a short silence
+between them) into compacted audio for the engine, and a Timeline maps the
+engine's note events, chord segments and MIDI back to the original timestamps.
+Inference time then follows the amount of music rather than the file length.
+"""
+import io
+
+from startup import lazy_import
+
+# Frames quieter than this (relative to the loudest frame) count as silence
+THRESHOLD_DB = -45.0
+# Spectral flatness above this is noise (white noise ~0.5+, applause ~0.3, music < 0.1)
+MAX_FLATNESS = 0.3
+MIN_SILENCE = 1.0   # shorter inactive stretches are kept (rests, breaths)
+MIN_ACTIVE = 0.25   # shorter active blips are dropped (clicks, coughs)
+PAD = 0.3           # kept around every region so attacks and decays are not cut
+# Silence inserted between regions in the compacted audio, so notes do not run together
+GAP = 0.25
+# Below this share of skippable audio, compacting is not worth it
+MIN_SKIP = 0.1
+# Onsets in an inserted gap this close to the next region are early attacks of it (model
+# timing jitter) and are moved onto it; other notes starting in a gap are dropped
+SNAP = 0.05
+
+
+def _runs(mask):
+    """(start, end) frame index pairs of the True runs in a boolean array."""
+    np = lazy_import("numpy")
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def active_frames(S, threshold_db=THRESHOLD_DB, max_flatness=MAX_FLATNESS):
+    """Boolean per STFT frame: loud enough and tonal enough to be worth transcribing."""
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    S = np.asarray(S)
+    rms = librosa.feature.rms(S=S, frame_length=2 * (S.shape[0] - 1))[0]
+    if not len(rms) or rms.max() <= 0:
+        return np.zeros(len(rms), dtype=bool)
+    loud = librosa.amplitude_to_db(rms, ref=np.max) > threshold_db
+    tonal = librosa.feature.spectral_flatness(S=S)[0] < max_flatness
+    return loud & tonal
+
+def activity_regions(S, sr, hop_length=512, duration=None, threshold_db=THRESHOLD_DB,
+                     max_flatness=MAX_FLATNESS, min_silence=MIN_SILENCE, min_active=MIN_ACTIVE, pad=PAD):
+    """Active regions [(start_s, end_s), ...] of a magnitude STFT."""
+    mask = active_frames(S, threshold_db, max_flatness)
+    frame_seconds = hop_length / sr
+    duration = len(mask) * frame_seconds if duration is None else duration
+    # Bridge short gaps, then drop short blips
+    starts, ends = _runs(~mask)
+    for start, end in zip(starts, ends):
+        if start > 0 and end < len(mask) and (end - start) * frame_seconds < min_silence:
+            mask[start:end] = True
+    regions = []
+    for start, end in zip(*_runs(mask)):
+        if (end - start) * frame_seconds < min_active:
+            continue
+        t0, t1 = max(start * frame_seconds - pad, 0.0), min(end * frame_seconds + pad, duration)
+        if regions and t0 <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], t1)
+        else:
+            regions.append((t0, t1))
+    return regions
+
+def detect_activity(y, sr, n_fft=2048, hop_length=512, **options):
+    """Timeline for mono audio y (computes the STFT; use activity_regions with a stored one)."""
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    S = np.abs(librosa.stft(np.asarray(y, dtype=np.float32), n_fft=n_fft, hop_length=hop_length))
+    duration = len(y) / sr
+    return Timeline(activity_regions(S, sr, hop_length, duration, **options), duration)
+
+
+class Timeline:
+    """Active regions of a track and the mapping between its compacted audio and the original."""
+
+    def __init__(self, regions, duration, gap=GAP):
+        np = lazy_import("numpy")
+        self.duration = float(duration)
+        self.gap = gap
+        self.regions = np.asarray(regions, dtype=np.float64).reshape(-1, 2)
+        lengths = self.regions[:, 1] - self.regions[:, 0]
+        # Start of every region in the compacted audio
+        self.compact_starts = np.concatenate([[0.0], np.cumsum(lengths + gap)])[:len(lengths)]
+        self.compact_ends = self.compact_starts + lengths
+        self.active_seconds = float(lengths.sum())
+
+    @property
+    def skipped_seconds(self):
+        return self.duration - self.active_seconds
+
+    def worth_skipping(self, min_skip=MIN_SKIP):
+        return self.duration > 0 and self.skipped_seconds / self.duration >= min_skip
+
+    def summary(self):
+        return {
+            "regions": len(self.regions),
+            "active_s": round(self.active_seconds, 2),
+            "skipped_s": round(self.skipped_seconds, 2),
+            "duration_s": round(self.duration, 2),
+        }
+
+    def compact(self, y, sr):
+        """The active regions of y joined with `gap` seconds of silence between them."""
+        np = lazy_import("numpy")
+        silence = np.zeros(int(round(self.gap * sr)), dtype=np.float32)
+        pieces = []
+        for i, (start, end) in enumerate(self.regions):
+            if i:
+                pieces.append(silence)
+            pieces.append(np.asarray(y[int(round(start * sr)):int(round(end * sr))], dtype=np.float32))
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+    # --- BACK TO ORIGINAL TIME ---
+
+    def _knots(self):
+        """Compacted -> original time knots; gaps map linearly onto the skipped stretch."""
+        np = lazy_import("numpy")
+        compact = np.column_stack([self.compact_starts, self.compact_ends]).ravel()
+        return compact, self.regions.ravel()
+
+    def to_original(self, times):
+        np = lazy_import("numpy")
+        compact, original = self._knots()
+        if not len(compact):
+            return np.asarray(times, dtype=np.float64)
+        return np.interp(times, compact, original)
+
+    def _note_times(self, starts, ends):
+        """Original (starts, ends, keep); a note is cut at the end of the region it starts in,
+        so it never spans skipped audio. keep is False for notes starting in an inserted gap
+        (audio that is not in the original), except early attacks within SNAP of a region."""
+        np = lazy_import("numpy")
+        starts, ends = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+        region = np.clip(np.searchsorted(self.compact_starts, starts, side="right") - 1, 0, len(self.regions) - 1)
+        in_gap = starts >= self.compact_ends[region]
+        following = np.minimum(region + 1, len(self.regions) - 1)
+        # (1 ms of slack for MIDI tick rounding)
+        early = self.compact_starts[following] - starts <= SNAP + 1e-3
+        snap = in_gap & (region + 1 < len(self.regions)) & early
+        region = np.where(snap, following, region)
+        starts = np.where(snap, self.compact_starts[following], starts)
+        new_starts = self.to_original(starts)
+        new_ends = np.maximum(np.minimum(self.to_original(ends), self.regions[region, 1]), new_starts)
+        return new_starts, new_ends, ~in_gap | snap
+
+    def events(self, note_events):
+        """Note events [(start, end, pitch, amplitude), ...] in original time."""
+        if not note_events or not len(self.regions):
+            return list(note_events)
+        starts, ends, keep = self._note_times([e[0] for e in note_events], [e[1] for e in note_events])
+        return [
+            (s, e) + tuple(event[2:])
+            for s, e, kept, event in zip(starts.tolist(), ends.tolist(), keep.tolist(), note_events)
+            if kept
+        ]
+
+    def segments(self, segments):
+        """Chord segments [(start, end, label), ...] in original time, split where they cross skipped audio."""
+        out = []
+        for start, end, label in segments:
+            for c0, c1, o0 in zip(self.compact_starts, self.compact_ends, self.regions[:, 0]):
+                lo, hi = max(start, c0), min(end, c1)
+                if hi > lo:
+                    piece = (float(o0 + lo - c0), float(o0 + hi - c0), label)
+                    if out and out[-1][2] == label and abs(out[-1][1] - piece[0]) < 1e-6:
+                        out[-1] = (out[-1][0], piece[1], label)
+                    else:
+                        out.append(piece)
+        return out
+
+    def midi(self, midi_bytes):
+        """MIDI bytes with notes, pitch bends and controller changes moved to original time.
+
+        The tempo map is left alone (pretty_midi's adjust_times would stretch it
+        over every skipped stretch).
+        """
+        pretty_midi = lazy_import("pretty_midi")
+        if not len(self.regions):
+            return midi_bytes
+        pm = pretty_midi.PrettyMIDI(io.BytesIO(midi_bytes))
+        for instrument in pm.instruments:
+            if instrument.notes:
+                starts, ends, keep = self._note_times([n.start for n in instrument.notes],
+                                                      [n.end for n in instrument.notes])
+                for note, start, end in zip(instrument.notes, starts.tolist(), ends.tolist()):
+                    note.start, note.end = start, end
+                instrument.notes = [note for note, kept in zip(instrument.notes, keep.tolist()) if kept]
+            for events in (instrument.pitch_bends, instrument.control_changes):
+                if events:
+                    for event, t in zip(events, self.to_original([e.time for e in events]).tolist()):
+                        event.time = t
+        buffer = io.BytesIO()
+        pm.write(buffer)
+        return buffer.getvalue()
+
+
+# --- TRANSCRIPTION ---
+
+def transcribe_active(audio, spectrogram=None, transcribe=None, hop_length=512, min_skip=MIN_SKIP, **options):
+    """Transcribes only the active parts of mono SAMPLE_RATE audio.
+
+    spectrogram: the magnitude STFT of audio (e.g. the feature store's "stft"),
+    computed here if not given. transcribe defaults to engine.transcribe_audio.
+    Returns (note_events, midi_bytes, timeline) in original time; when there is
+    too little to skip the whole audio is transcribed as is.
+    """
+    engine = lazy_import("engine")
+    transcribe = transcribe or engine.transcribe_audio
+    sr = engine.SAMPLE_RATE
+    if spectrogram is None:
+        timeline = detect_activity(audio, sr, hop_length=hop_length)
+    else:
+        timeline = Timeline(activity_regions(spectrogram, sr, hop_length, len(audio) / sr), len(audio) / sr)
+    if not timeline.worth_skipping(min_skip):
+        note_events, midi_bytes = transcribe(audio, **options)
+        return note_events, midi_bytes, timeline
+    if not len(timeline.regions):
+        # Nothing to transcribe: an empty result without running the model
+        return [], _empty_midi(), timeline
+    note_events, midi_bytes = transcribe(timeline.compact(audio, sr), **options)
+    return timeline.events(note_events), timeline.midi(midi_bytes), timeline
+
+def _empty_midi():
+    pretty_midi = lazy_import("pretty_midi")
+    pm = pretty_midi.PrettyMIDI()
+    pm.instruments.append(pretty_midi.Instrument(program=0))
+    buffer = io.BytesIO()
+    pm.write(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,316 @@
+"""Small HTTP API for machine clients, running alongside the Streamlit UI.
+
+    python latest/api.py --port 8502
+
+    POST /jobs?filename=song.mp3[&chords=1][&skip_silence=0]
+                                               body = raw audio bytes -> 202 {"job_id", ...}
+    GET  /jobs/<id>[?wait=10]                  job status (optionally long-poll until done)
+    GET  /jobs/<id>/notes                      note events as JSON
+    GET  /jobs/<id>/chords                     chord segments as JSON (needs chord_extractor)
+    GET  /jobs/<id>/midi                       Basic Pitch MIDI file
+    GET  /jobs/<id>/bundle                     zip of MIDI, notes CSV/TXT, MusicXML and chords (built on request)
+    GET  /jobs/<id>/musicxml, /abc             sheet music, streamed measure by measure
+    GET  /health
+    GET  /metrics                              inference batching, artifact and feature store metrics
+
+Identical audio (same bytes and options) submitted while an analysis is queued or
+running attaches to that job instead of starting a second one (single-flight).
+Results (notes, MIDI, chords, built exports) live in the artifact store under the
+job's id and expire with it; requests for expired results get 410 Gone.
+A trimmed, extended or re-encoded version of earlier audio reuses that
+analysis's notes and only transcribes what changed (incremental.py; see the
+job's "reuse" summary).
+Only the standard library is used for serving; nothing external is required.
+"""
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import engine
+import incremental
+import sheet
+from artifacts import get_store
+from chords import extract_chords_parallel
+from exports import AnalysisExports
+from features import audio_key, get_feature_store
+from note_store import NoteTable
+
+MAX_UPLOAD_BYTES = int(os.environ.get("CHORDIA_API_MAX_UPLOAD_MB", "100")) * 1024 * 1024
+ALLOWED_EXTENSIONS = (".mp3", ".wav")
+
+
+class Job:
+    def __init__(self, key, filename, options):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.filename = filename
+        self.options = options
+        self.status = "queued"
+        self.error = None
+        self.note_count = None
+        self.has_chords = False
+        self.activity = None
+        self.reuse = None
+        self.attached = 0
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def summary(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "error": self.error,
+            "attached_requests": self.attached,
+            "note_count": self.note_count,
+            "activity": self.activity,
+            "reuse": self.reuse,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    """Runs transcription jobs on a worker pool with single-flight dedupe of identical uploads."""
+
+    def __init__(self, workers=1, keep_finished=100):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chordia-job")
+        self.keep_finished = keep_finished
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.in_flight = {}
+
+    def submit(self, audio_bytes, filename, options):
+        """Returns (job, deduplicated)."""
+        key = hashlib.sha256(audio_bytes + json.dumps(options, sort_keys=True).encode()).hexdigest()
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is not None:
+                job.attached += 1
+                return job, True
+            job = Job(key, filename, options)
+            self.jobs[job.id] = job
+            self.in_flight[key] = job
+        self.executor.submit(self._run, job, audio_bytes)
+        return job, False
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def exports(self, job):
+        """AnalysisExports over the job's stored results, or None once they have expired."""
+        store = get_store()
+        owner = f"job-{job.id}"
+        table = store.get(owner, "notes")
+        midi_bytes = store.get(owner, "midi")
+        chords = store.get(owner, "chords")
+        if table is None or midi_bytes is None or (job.has_chords and chords is None):
+            return None
+        return AnalysisExports(table, midi_bytes, chords=chords, name=os.path.splitext(job.filename)[0],
+                               cache=store.scope(owner))
+
+    def _run(self, job, audio_bytes):
+        job.status = "running"
+        store = get_store()
+        owner = f"job-{job.id}"
+        suffix = os.path.splitext(job.filename)[1].lower()
+        try:
+            store.put(owner, "upload", audio_bytes, on_disk=True, suffix=suffix)
+            path = store.path(owner, "upload")
+            # Decoded PCM is shared with the UI (and earlier jobs) for identical audio
+            features = get_feature_store()
+            key = features.add_audio(path, audio_key(audio_bytes))
+            pcm = features.get(key, "pcm")
+            skip_silence = job.options.get("skip_silence", True)
+            activity = {}
+            transcribe = incremental.engine_transcriber(pcm, features.get(key, "stft") if skip_silence else None,
+                                                        skip_silence, activity)
+            # Re-submitted edits of earlier uploads only transcribe what changed
+            note_events, midi_bytes, job.reuse = incremental.analyze(
+                store, key, pcm, engine.SAMPLE_RATE, features.get(key, "mel"), 512, transcribe,
+                variant=f"mix|{skip_silence}",
+            )
+            job.activity = activity or None
+            table = store.put(owner, "notes", NoteTable.from_events(note_events))
+            store.put(owner, "midi", midi_bytes)
+            if job.options.get("chords"):
+                store.put(owner, "chords", extract_chords_parallel(path, skip_silence=job.options.get("skip_silence", True)))
+                job.has_chords = True
+            job.note_count = len(table)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            # The upload is only needed while the job runs
+            store.release(owner, prefix="upload")
+            job.finished = time.time()
+            with self.lock:
+                self.in_flight.pop(job.key, None)
+                self._evict_finished()
+            job.done.set()
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+            get_store().release(f"job-{job_id}")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    manager = None
+    server_version = "ChordiaAPI/1.0"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+
+        if parts == ["health"]:
+            return self._json(200, {"status": "ok"})
+        if parts == ["metrics"]:
+            try:
+                batching = engine.batching_metrics()
+            except (OSError, RuntimeError) as e:
+                # Model server down or failing: the store metrics are still worth serving
+                batching = {"error": str(e)}
+            return self._json(200, {
+                "batching": batching,
+                "artifacts": get_store().metrics(),
+                "features": get_feature_store().metrics(),
+            })
+        if len(parts) < 2 or parts[0] != "jobs":
+            return self._json(404, {"error": "not found"})
+
+        job = self.manager.get(parts[1])
+        if job is None:
+            return self._json(404, {"error": "unknown job"})
+        if len(parts) == 2:
+            try:
+                wait = min(float(query.get("wait", ["0"])[0]), 60.0)
+            except ValueError:
+                return self._json(400, {"error": "wait must be a number"})
+            if wait > 0:
+                job.done.wait(wait)
+            return self._json(200, job.summary())
+
+        if job.status != "done":
+            return self._json(409, job.summary())
+        resource = parts[2]
+        if resource not in ("notes", "chords", "midi", "bundle", "musicxml", "abc"):
+            return self._json(404, {"error": "not found"})
+        if resource == "chords" and not job.has_chords:
+            return self._json(404, {"error": "chords were not requested for this job (use chords=1)"})
+        exports = self.manager.exports(job)
+        if exports is None:
+            return self._json(410, {"error": "results for this job have expired; submit the audio again"})
+        if resource == "notes":
+            return self._json(200, {"job_id": job.id, "notes": exports.table.records()})
+        if resource == "chords":
+            chords = [
+                {"start": round(start, 3), "end": round(end, 3), "chord": chord}
+                for start, end, chord in exports.chords()
+            ]
+            return self._json(200, {"job_id": job.id, "chords": chords})
+        if resource == "midi":
+            return self._bytes(200, exports.midi(), "audio/midi", "transcription.mid")
+        if resource == "musicxml":
+            return self._stream(sheet.write_musicxml, exports, "application/vnd.recordare.musicxml+xml",
+                                "transcription.musicxml")
+        if resource == "abc":
+            return self._stream(sheet.write_abc, exports, "text/vnd.abc", "transcription.abc")
+        return self._bytes(200, exports.bundle(), "application/zip", "chordia_export.zip")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._json(404, {"error": "not found"})
+        query = parse_qs(url.query)
+        filename = os.path.basename(query.get("filename", ["upload.wav"])[0])
+        if not filename.lower().endswith(ALLOWED_EXTENSIONS):
+            return self._json(400, {"error": "only mp3 and wav uploads are supported"})
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return self._json(400, {"error": "invalid Content-Length"})
+        if length <= 0:
+            return self._json(400, {"error": "empty upload"})
+        if length > MAX_UPLOAD_BYTES:
+            return self._json(413, {"error": "upload too large"})
+        audio_bytes = self.rfile.read(length)
+
+        options = {
+            "chords": query.get("chords", ["0"])[0] in ("1", "true", "yes"),
+            "skip_silence": query.get("skip_silence", ["1"])[0] in ("1", "true", "yes"),
+        }
+        job, deduplicated = self.manager.submit(audio_bytes, filename, options)
+        body = job.summary()
+        body["deduplicated"] = deduplicated
+        return self._json(202, body)
+
+    def _json(self, status, payload):
+        self._bytes(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _bytes(self, status, data, content_type, download_name=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if download_name:
+            self.send_header("Content-Disposition", f'attachment; filename="{download_name}"')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def _stream(self, write, exports, content_type, download_name):
+        """Writes a sheet-music export straight to the socket (no Content-Length; the connection closes)."""
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Disposition", f'attachment; filename="{download_name}"')
+        self.send_header("Connection", "close")
+        self.end_headers()
+        write(exports.table, codecs.getwriter("utf-8")(self.wfile), title=exports.name)
+
+
+def create_server(host="127.0.0.1", port=8502, workers=1):
+    handler = type("BoundApiHandler", (ApiHandler,), {"manager": JobManager(workers=workers)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chordia HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CHORDIA_API_WORKERS", "1")))
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.workers)
+    # Load the model before accepting jobs so the first request is not the slow one; with a
+    # shared model server, only connect to it (never import TensorFlow here)
+    if engine.model_server_socket():
+        preload = lambda: engine.get_model_client().ping()
+    else:
+        preload = engine.get_model
+    threading.Thread(target=preload, name="chordia-preload", daemon=True).start()
+    print(f"Chordia API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,95 @@
 import streamlit as st
-import librosa
-import librosa.display
-import numpy as np
-import matplotlib.pyplot as plt
+import math
 import os
-import pandas as pd
-from basic_pitch.inference import predict_and_save, Model
-from basic_pitch import ICASSP_2022_MODEL_PATH # Import the default model path
-from mido import MidiFile
-#import torch
+import sys
+import time
+from startup import HEAVY_MODULES, lazy_import, mark_once, preload_in_background, preload_done, startup_report
+from engine import get_model, get_model_client, model_server_socket
+from chords import chords_available, extract_chords_parallel
+# Heavy libraries (librosa, matplotlib, pandas, basic_pitch/TensorFlow) are imported
+# lazily where they are used and warmed up in the background after the page is served.
 
 st.set_page_config(page_title="Chordia V10", layout="wide")
 
 # --- CORE UTILITIES ---
 
-def get_note_name(midi_number):
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    octave = (midi_number // 12) - 1
-    return f"{notes[midi_number % 12]}{octave}"
-
-def parse_midi_to_list(midi_path):
-    mid = MidiFile(midi_path)
-    note_events = []
-    current_time = 0
-    # Basic Pitch uses 480 ticks per beat
-    for track in mid.tracks:
-        for msg in track:
-            current_time += msg.time
-            if msg.type == 'note_on' and msg.velocity > 0:
-                note_events.append({
-                    "Timestamp (s)": round(current_time / 480.0, 2),
-                    "Note": get_note_name(msg.note),
-                    "Instrument Style": "String/Melodic"
-                })
-    return sorted(note_events, key=lambda x: x['Timestamp (s)'])
+def preload_heavy_dependencies():
+    if model_server_socket():
+        # Models live in the shared model server; never import TensorFlow in UI replicas
+        modules = [name for name in HEAVY_MODULES if not name.startswith("basic_pitch")]
+        model_task = ("model server", lambda: get_model_client().ping())
+    else:
+        modules = HEAVY_MODULES
+        model_task = ("basic_pitch_model", get_model)
+    preload_in_background([(name, lambda name=name: lazy_import(name)) for name in modules] + [model_task])
+
+def session_owner():
+    """Artifact owner id for the current browser session."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return f"session-{ctx.session_id}" if ctx else "session-local"
+
+UPLOAD_EXPIRED = "The upload expired to free up space, please re-upload the file."
+
+def upload_path(store, owner):
+    """Path of the session's stored upload; raises if it has been evicted since the page rendered."""
+    path = store.path(owner, "upload")
+    if path is None:
+        raise FileNotFoundError(UPLOAD_EXPIRED)
+    return path
+
+# --- PLAYBACK GUIDE ---
+# Only the visible time window / page is sent to the browser, and interacting
+# with the guide reruns just this fragment, so cost does not grow with track length.
+
+GUIDE_PAGE_SIZE = 50
+
+def render_playback_guide(table, chords=None, tuning=None, capo=0):
+    follow = st.session_state.get('follow_from')  # (position, wall-clock start) while following
+    # No timer once playback has reached the end
+    following = follow is not None and follow[0] + time.time() - follow[1] < table.duration
+
+    @st.fragment(run_every=1.0 if following else None)
+    def guide():
+        window = st.select_slider("Window (s)", [5, 10, 20, 30, 60], value=10, key="guide_window")
+        if follow:
+            position = min(table.duration, follow[0] + time.time() - follow[1])
+            st.caption(f"Following playback at {position:.1f}s")
+            if st.button("⏹ Stop following") or position >= table.duration:
+                st.session_state['guide_position'] = math.floor(position * 10) / 10  # within the slider's range
+                del st.session_state['follow_from']
+                st.rerun()
+        else:
+            position = st.slider("Position (s)", 0.0, max(table.duration, 0.1), step=0.1, key="guide_position")
+            if st.button("▶️ Play & follow from here"):
+                st.session_state['follow_from'] = (position, time.time())
+                st.rerun()
+
+        # Interval-index lookups: O(log n) however long the piece is
+        now = " ".join(table.sounding(position)) or "—"
+        if chords is not None:
+            now = f"**{chords.label(int(chords.enclosing(position))) or '—'}** · {now}"
+        st.markdown(f"Now: {now}")
+
+        lo, hi = table.range(position, position + window)
+        pages = max(1, math.ceil((hi - lo) / GUIDE_PAGE_SIZE))
+        page = 1
+        if st.session_state.get('guide_page_range') != (lo, hi):
+            # One page widget for every window, back on its first page when the window moves
+            st.session_state['guide_page_range'] = (lo, hi)
+            st.session_state['guide_page'] = 1
+        if pages > 1 and not follow:
+            page = st.number_input(f"Page (of {pages})", 1, pages, key="guide_page")
+        first = lo + (page - 1) * GUIDE_PAGE_SIZE
+        last = min(hi, first + GUIDE_PAGE_SIZE)
+        rows = table.rows(first, last, chords=chords)
+        if tuning:
+            for row, tab in zip(rows, lazy_import("transpose").tab_labels(table.pitch[first:last], tuning, capo)):
+                row["Tab"] = tab
+        st.dataframe(rows, height=400, width='stretch')
+        st.caption(f"{hi - lo} notes between {position:.1f}s and {position + window:.1f}s ({len(table)} total)")
+
+    guide()
 
 # --- UI ---
 
@@ -41,66 +97,191 @@ st.title("🎸 Chordia V10")
 st.markdown("Supports **Guitar, Violin, Piano, and Bass**. Detects individual notes and timing.")
 
 uploaded_file = st.file_uploader("Upload Music File", type=["mp3", "wav"])
+mark_once("upload widget rendered")
 
 if uploaded_file:
-    temp_audio = f"temp_{uploaded_file.name}"
-    with open(temp_audio, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # Uploads, MIDI, note tables and exports live in the artifact store, owned by this
+    # session and expired/evicted by its sweeper instead of piling up in the working directory
+    store = lazy_import("artifacts").get_store()
+    owner = session_owner()
+    features = lazy_import("features")
+    if st.session_state.get('upload_id') != uploaded_file.file_id or not store.has(owner, "upload"):
+        store.put(owner, "upload", uploaded_file.getvalue(), on_disk=True,
+                  suffix=os.path.splitext(uploaded_file.name)[1].lower())
+        store.release(owner, prefix="stem_")  # stems belong to the previous upload
+        if st.session_state.get('upload_id') != uploaded_file.file_id:
+            # So do its notes, built exports and extracted chords
+            store.release(owner, prefix="analysis_")
+            store.release(owner, prefix="export_")
+            for key in ('analysis', 'follow_from', 'guide_position'):
+                st.session_state.pop(key, None)
+        st.session_state['upload_id'] = uploaded_file.file_id
+        st.session_state['audio_key'] = features.audio_key(uploaded_file.getvalue())
+    temp_audio = store.path(owner, "upload")
+    if temp_audio is None:
+        st.warning(UPLOAD_EXPIRED)
+        st.stop()
+    # Decoded audio and spectrograms are computed once per audio file and shared
+    # (memory-mapped) by the display, the engines and other sessions
+    feature_store = features.get_feature_store()
+    audio_key = feature_store.add_audio(temp_audio, st.session_state['audio_key'])
 
     # Visualizer
-    y, sr = librosa.load(temp_audio)
+    librosa = lazy_import("librosa")
+    lazy_import("librosa.display")
+    np = lazy_import("numpy")
+    plt = lazy_import("matplotlib.pyplot")
     fig, ax = plt.subplots(figsize=(12, 3))
-    S = librosa.feature.melspectrogram(y=y, sr=sr)
-    librosa.display.specshow(librosa.power_to_db(S, ref=np.max), x_axis='time', y_axis='mel', ax=ax)
+    S = feature_store.get(audio_key, "mel")
+    librosa.display.specshow(librosa.power_to_db(S, ref=np.max), x_axis='time', y_axis='mel', ax=ax,
+                             sr=features.SAMPLE_RATE)
     st.pyplot(fig)
-    st.audio(uploaded_file)
+    follow = st.session_state.get('follow_from')
+    st.audio(uploaded_file, start_time=int(follow[0]) if follow else 0, autoplay=follow is not None)
 
     # Instrument Mode Selection
     mode = st.selectbox("Select Primary Instrument to Transcribe", 
                         ["Guitar/Violin (Polyphonic)", "Bass Guitar", "Piano", "Drums (Beat Only)"])
+    separate = st.checkbox("🎤 Separate vocals and drums first (slower the first time; stems are reused across modes)",
+                           key="separate")
+    skip_silence = st.checkbox("🔇 Skip silence and noise (count-ins, applause, gaps) before transcribing",
+                               value=True, key="skip_silence")
 
     if st.button("🚀 Analyze Instrument", type="primary"):
         with st.spinner(f"Extracting {mode} notes..."):
             try:
-                # Load the model explicitly
-                model = Model(ICASSP_2022_MODEL_PATH)
-            
-                output_dir = "."
-                # Pass the 'model' as the first argument
-                predict_and_save(
-                    audio_path_list=[temp_audio],
-                    output_directory=output_dir,
-                    save_midi=True,
-                    sonify_midi=False,
-                    save_model_outputs=False,
-                    save_notes=True,
-                    model_or_model_path=model # Add this line
+                timings = {}
+                audio = feature_store.get(audio_key, "pcm")
+                source_key, stem = audio_key, "mix"
+                if separate:
+                    separation = lazy_import("separation")
+                    stems, timings["separation_s"] = separation.get_stems(store, owner, audio)
+                    stem = separation.MODE_STEMS[mode]
+                    source_key = feature_store.add_audio(stems[stem])
+                    audio = feature_store.get(source_key, "pcm")
+                started = time.perf_counter()
+                # Runs on the shared model server when CHORDIA_MODEL_SOCKET is set,
+                # otherwise on the model warmed up by the background preload.
+                # Activity is detected on the mix's stored STFT; stems line up with it
+                incremental = lazy_import("incremental")
+                activity = {}
+                transcribe = incremental.engine_transcriber(
+                    audio, feature_store.get(audio_key, "stft") if skip_silence else None, skip_silence, activity
                 )
-                
-                # Basic Pitch generates a file named: [temp_audio]_basic_pitch.mid
-                midi_output = temp_audio.replace(".mp3", "_basic_pitch.mid").replace(".wav", "_basic_pitch.mid")
-                
-                st.session_state['midi_ready'] = midi_output
-                st.session_state['note_list'] = parse_midi_to_list(midi_output)
+                # Regions matching an earlier upload (trimmed, extended, re-encoded) reuse its notes
+                note_events, midi_bytes, reuse = incremental.analyze(
+                    store, source_key, audio, features.SAMPLE_RATE,
+                    feature_store.get(source_key, "mel"), 512, transcribe, variant=f"{stem}|{skip_silence}",
+                )
+                if activity:
+                    timings["activity"] = activity
+                if reuse:
+                    timings["reuse"] = reuse
+                timings["transcription_s"] = time.perf_counter() - started
+
+                # One analysis per session: drop the previous one's artifacts and the exports built from them
+                store.release(owner, prefix="analysis_")
+                store.release(owner, prefix="export_")
+                store.put(owner, "analysis_notes", lazy_import("note_store").NoteTable.from_events(note_events))
+                store.put(owner, "analysis_midi", midi_bytes)
+                st.session_state['analysis'] = {
+                    "name": os.path.splitext(uploaded_file.name)[0],
+                    "separated": separate,
+                    "skip_silence": skip_silence,
+                    "timings": timings,
+                }
+                for key in ('follow_from', 'guide_position'):
+                    st.session_state.pop(key, None)
                 st.success("Transcription Complete!")
 
             except Exception as e:
                 st.error(f"Analysis failed: {e}")
 
-    if 'midi_ready' in st.session_state:
+    analysis = st.session_state.get('analysis')
+    table = store.get(owner, "analysis_notes") if analysis else None
+    midi_bytes = store.get(owner, "analysis_midi") if analysis else None
+    if analysis and (table is None or midi_bytes is None):
+        st.info("These results expired to free up space. Click Analyze again to regenerate them.")
+    elif analysis:
+        # Export files are only generated when a download is clicked, then memoized in the store
+        chords = None
+        if chords_available():
+            chords = lambda: extract_chords_parallel(upload_path(store, owner),
+                                                     skip_silence=analysis.get("skip_silence", True))
+        exports = lazy_import("exports").AnalysisExports(
+            table, midi_bytes, chords=chords, name=analysis["name"], cache=store.scope(owner)
+        )
+
+        # Key, tuning and capo are applied to the cached results; the model is not rerun
+        transpose = lazy_import("transpose")
+        default_tuning = {"Guitar/Violin (Polyphonic)": 1, "Bass Guitar": 6}.get(mode, 0)
+        with st.expander("🎚️ Key, Tuning & Capo"):
+            k1, k2, k3 = st.columns(3)
+            semitones = k1.number_input("Transpose (semitones)", -12, 12, 0, key="arr_semitones")
+            tuning = k2.selectbox("Tab tuning", ["None"] + list(transpose.TUNINGS), index=default_tuning, key="arr_tuning")
+            capo = k3.number_input("Capo", 0, 12, 0, key="arr_capo", disabled=tuning == "None")
+        tuning = None if tuning == "None" else tuning
+        exports = exports.arranged(semitones, tuning, capo if tuning else 0)
+
+        timings = analysis["timings"]
+        parts = []
+        if "separation_s" in timings:
+            parts.append("Source separation: " + ("reused cached stems" if timings["separation_s"] is None
+                                                  else f"{timings['separation_s']:.1f}s"))
+        parts.append(f"Transcription: {timings['transcription_s']:.1f}s")
+        activity = timings.get("activity")
+        if activity and activity["skipped_s"] > 0:
+            parts.append(f"skipped {activity['skipped_s']:.0f}s of {activity['duration_s']:.0f}s (silence/noise)")
+        reuse = timings.get("reuse")
+        if reuse and reuse["reused_s"] > 0:
+            parts.append(f"♻️ reused {reuse['reused_s']:.0f}s from an earlier upload, "
+                         f"transcribed {reuse['transcribed_s']:.0f}s")
+        st.caption("⏱️ " + " · ".join(parts))
+        if analysis["separated"] and store.has(owner, "stem_harmonic"):
+            with st.expander("🎧 Separated Stems"):
+                for name in lazy_import("separation").STEMS:
+                    path = store.path(owner, f"stem_{name}")
+                    if path:
+                        st.caption(name.capitalize())
+                        st.audio(path)
+
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("📋 Playback Guide (Letter Notes)")
-            df = pd.DataFrame(st.session_state['note_list'])
-            st.dataframe(df, height=400, use_container_width=True)
+            chord_index = exports.chord_index() if exports.cached_chords() is not None else None
+            render_playback_guide(exports.table, chord_index, exports.tuning, exports.capo)
+            if chords_available() and chord_index is None and st.button("🎼 Show chords in the guide"):
+                with st.spinner("Detecting chords..."):
+                    try:
+                        exports.chords()
+                    except Exception as e:
+                        st.error(f"Chord detection failed: {e}")
+                    else:
+                        st.rerun()
         
         with col2:
             st.subheader("📥 Export")
-            with open(st.session_state['midi_ready'], "rb") as f:
-                st.download_button("Download Universal MIDI", f, "instrument_track.mid")
-            
-            # Formatting notes for easy reading on an instrument
-            text_notes = "\n".join([f"{n['Timestamp (s)']}s: {n['Note']}" for n in st.session_state['note_list']])
-            st.download_button("Download Note Sheet (.txt)", text_notes, "sheet_music.txt")
-
-    os.remove(temp_audio)
\ No newline at end of file
+            st.download_button("📦 Download Everything (.zip)", exports.bundle, "chordia_export.zip",
+                               mime="application/zip", type="primary")
+            st.download_button("Download Universal MIDI", exports.midi, "instrument_track.mid", mime="audio/midi")
+            st.download_button("Download Note Sheet (.txt)", exports.notes_txt, "sheet_music.txt", mime="text/plain")
+            st.download_button("Download Notes (.csv)", exports.notes_csv, "notes.csv", mime="text/csv")
+            st.download_button("Download Sheet Music (.musicxml)", exports.musicxml, "sheet_music.musicxml",
+                               mime="application/vnd.recordare.musicxml+xml")
+            st.download_button("Download Sheet Music (.abc)", exports.abc, "sheet_music.abc", mime="text/vnd.abc")
+            if exports.tuning:
+                st.download_button("Download Tabs (.txt)", exports.tabs_txt, "tabs.txt", mime="text/plain")
+            if not chords_available():
+                st.caption("Install `chord_extractor` to include chords in the bundle.")
+
+# Warm up heavy imports and the model only after the page has been sent
+preload_heavy_dependencies()
+with st.sidebar.expander("⏱️ Startup Timings"):
+    st.caption("Preload finished." if preload_done() else "Preloading models in the background...")
+    st.table(startup_report())
+if 'artifacts' in sys.modules:
+    with st.sidebar.expander("🗄️ Artifact Store"):
+        st.json(sys.modules['artifacts'].get_store().metrics())
+if 'features' in sys.modules:
+    with st.sidebar.expander("📈 Feature Store"):
+        st.json(sys.modules['features'].get_feature_store().metrics())
\ No newline at end of file
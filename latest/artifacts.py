@@ -0,0 +1,275 @@
+"""Managed store for analysis artifacts (uploads, MIDI, note tables, exports).
+
+Every artifact belongs to an owner (a Streamlit session or an API job) and has a
+name within it. Compact objects (NoteTable arrays, small bytes) stay in memory;
+bytes of DISK_THRESHOLD and above are written under the store root instead of
+the service working directory. Artifacts expire `ttl_seconds` after their last
+access, and when the memory or disk quota is exceeded the least recently used
+artifacts are evicted first. A background sweeper enforces both, so a
+long-running service does not grow without bound.
+
+Configured with CHORDIA_ARTIFACT_DIR, CHORDIA_ARTIFACT_TTL (seconds),
+CHORDIA_ARTIFACT_MEMORY_MB and CHORDIA_ARTIFACT_DISK_MB.
+"""
+import atexit
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from startup import resource
+
+DISK_THRESHOLD = 64 * 1024
+
+
+def _size_of(value):
+    """Estimated memory held by a stored value (arrays, NoteTable and IntervalIndex report nbytes)."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        # e.g. chord segments [(start, end, label), ...]: count the tuples' contents too
+        return sys.getsizeof(value) + sum(_size_of(v) for v in value)
+    return sys.getsizeof(value)
+
+def _safe(name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Artifact:
+    __slots__ = ("owner", "name", "value", "path", "size", "created", "accessed")
+
+    def __init__(self, owner, name, value, path, size):
+        self.owner = owner
+        self.name = name
+        self.value = value
+        self.path = path
+        self.size = size
+        self.created = self.accessed = time.time()
+
+
+class ArtifactScope:
+    """One owner's view of the store (what AnalysisExports uses as its cache)."""
+
+    def __init__(self, store, owner):
+        self.store = store
+        self.owner = owner
+
+    def get(self, name, default=None):
+        return self.store.get(self.owner, name, default)
+
+    def put(self, name, value, **kwargs):
+        return self.store.put(self.owner, name, value, **kwargs)
+
+    def path(self, name):
+        return self.store.path(self.owner, name)
+
+
+class ArtifactStore:
+    def __init__(self, root, ttl_seconds=3600, max_memory_bytes=256 * 2**20, max_disk_bytes=2 * 2**30):
+        # One directory per process so replicas sharing a root never delete each other's files
+        prefix = f"{socket.gethostname()}-"
+        self._remove_stale_dirs(root, prefix)
+        self.root = os.path.join(root, f"{prefix}{os.getpid()}")
+        os.makedirs(self.root, exist_ok=True)
+        atexit.register(shutil.rmtree, self.root, True)
+
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._items = {}
+        self._counters = {"puts": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0, "released": 0}
+        self._sweeper = None
+
+    def scope(self, owner):
+        return ArtifactScope(self, owner)
+
+    def put(self, owner, name, value, on_disk=None, suffix=""):
+        """Stores value under (owner, name), replacing any previous artifact with that name."""
+        if on_disk is None:
+            on_disk = isinstance(value, (bytes, bytearray)) and len(value) >= DISK_THRESHOLD
+        if on_disk:
+            owner_dir = os.path.join(self.root, _safe(owner))
+            os.makedirs(owner_dir, exist_ok=True)
+            path = os.path.join(owner_dir, _safe(name) + suffix)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+            item = _Artifact(owner, name, None, path, len(value))
+        else:
+            item = _Artifact(owner, name, value, None, _size_of(value))
+
+        with self._lock:
+            old = self._items.pop((owner, name), None)
+            self._items[(owner, name)] = item
+            self._counters["puts"] += 1
+        if old is not None and old.path and old.path != item.path:
+            self._delete_file(old.path)
+        self._enforce_quotas()
+        return value
+
+    def get(self, owner, name, default=None):
+        with self._lock:
+            item = self._items.get((owner, name))
+            if item is not None and time.time() - item.accessed > self.ttl_seconds:
+                self._items.pop((owner, name))
+                self._counters["expired"] += 1
+                expired, item = item, None
+            else:
+                expired = None
+            if item is None:
+                self._counters["misses"] += 1
+            else:
+                item.accessed = time.time()
+                self._counters["hits"] += 1
+        if expired is not None and expired.path:
+            self._delete_file(expired.path)
+        if item is None:
+            return default
+        if item.path is None:
+            return item.value
+        try:
+            with open(item.path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return default
+
+    def path(self, owner, name):
+        """File path of an on-disk artifact (refreshing its expiry), or None."""
+        with self._lock:
+            item = self._items.get((owner, name))
+            if item is None or item.path is None:
+                return None
+            item.accessed = time.time()
+            return item.path
+
+    def has(self, owner, name):
+        with self._lock:
+            return (owner, name) in self._items
+
+    def release(self, owner, prefix=""):
+        """Drops an owner's artifacts whose names start with prefix (all of them by default)."""
+        with self._lock:
+            keys = [key for key in self._items if key[0] == owner and key[1].startswith(prefix)]
+            items = [self._items.pop(key) for key in keys]
+            self._counters["released"] += len(items)
+        for item in items:
+            if item.path:
+                self._delete_file(item.path)
+        if not prefix:
+            shutil.rmtree(os.path.join(self.root, _safe(owner)), ignore_errors=True)
+
+    def sweep(self):
+        """Expires idle artifacts and enforces the quotas; returns how many were removed."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            keys = [key for key, item in self._items.items() if item.accessed < cutoff]
+            expired = [self._items.pop(key) for key in keys]
+            self._counters["expired"] += len(expired)
+        for item in expired:
+            if item.path:
+                self._delete_file(item.path)
+        return len(expired) + self._enforce_quotas()
+
+    def metrics(self):
+        with self._lock:
+            items = list(self._items.values())
+            counters = dict(self._counters)
+        memory = [i for i in items if i.path is None]
+        disk = [i for i in items if i.path is not None]
+        return dict(
+            counters,
+            owners=len({i.owner for i in items}),
+            memory_items=len(memory),
+            memory_bytes=sum(i.size for i in memory),
+            max_memory_bytes=self.max_memory_bytes,
+            disk_items=len(disk),
+            disk_bytes=sum(i.size for i in disk),
+            max_disk_bytes=self.max_disk_bytes,
+            ttl_seconds=self.ttl_seconds,
+        )
+
+    def start_sweeper(self, interval=60.0):
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweep_forever, args=(interval,), name="chordia-artifact-sweeper", daemon=True
+                )
+                self._sweeper.start()
+        return self
+
+    # --- INTERNALS ---
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[chordia] artifact sweep failed: {e}", file=sys.stderr)
+
+    def _enforce_quotas(self):
+        evicted = []
+        with self._lock:
+            for on_disk, limit in ((False, self.max_memory_bytes), (True, self.max_disk_bytes)):
+                candidates = [i for i in self._items.values() if (i.path is not None) == on_disk]
+                total = sum(i.size for i in candidates)
+                for item in sorted(candidates, key=lambda i: i.accessed):
+                    if total <= limit:
+                        break
+                    del self._items[(item.owner, item.name)]
+                    total -= item.size
+                    evicted.append(item)
+            self._counters["evicted"] += len(evicted)
+        for item in evicted:
+            if item.path:
+                self._delete_file(item.path)
+        return len(evicted)
+
+    @staticmethod
+    def _delete_file(path):
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))  # only succeeds once the owner has no files left
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove_stale_dirs(root, prefix):
+        """Cleans up directories left behind by earlier (crashed or restarted) processes."""
+        if not os.path.isdir(root):
+            return
+        for entry in os.listdir(root):
+            pid = entry[len(prefix):]
+            if entry.startswith(prefix) and pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def get_store():
+    """Process-wide artifact store with its background sweeper running."""
+    def build():
+        store = ArtifactStore(
+            os.environ.get("CHORDIA_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "chordia-artifacts")),
+            ttl_seconds=float(os.environ.get("CHORDIA_ARTIFACT_TTL", "3600")),
+            max_memory_bytes=int(float(os.environ.get("CHORDIA_ARTIFACT_MEMORY_MB", "256")) * 2**20),
+            max_disk_bytes=int(float(os.environ.get("CHORDIA_ARTIFACT_DISK_MB", "2048")) * 2**20),
+        )
+        return store.start_sweeper()
+    return resource("artifact_store", build)
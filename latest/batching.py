@@ -0,0 +1,127 @@
+"""Dynamic micro-batching of fixed-size model windows across concurrent requests.
+
+Every transcription (UI session, API job, live stream, model-server client) cuts
+its audio into fixed-size Basic Pitch windows. Instead of each request running
+its own small forward passes, MicroBatcher queues the windows and a single
+worker thread runs them in batches of up to `max_batch` windows. A batch is
+sent as soon as it is full or the oldest queued request has waited
+`max_wait_ms`, and the outputs are split back per request.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    arr = np.asarray(values, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 2),
+        "p95": round(float(np.percentile(arr, 95)), 2),
+        "max": round(float(arr.max()), 2),
+    }
+
+
+class MicroBatcher:
+    """Thread-safe batching front for a `predict(windows) -> {name: (n, ...)}` function."""
+
+    def __init__(self, predict, max_batch=32, max_wait_ms=10.0, history=1000):
+        self._predict = predict
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._queue = deque()
+        self._queued_windows = 0
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=history)
+        self._waits_ms = deque(maxlen=history)
+        self._totals = {"requests": 0, "batches": 0, "windows": 0, "busy_seconds": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="chordia-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, windows):
+        """Blocks until the windows have been run as part of one or more batches."""
+        windows = np.asarray(windows, dtype=np.float32)
+        if len(windows) == 0:
+            return self._predict(windows)
+        futures = []
+        with self._cond:
+            for start in range(0, len(windows), self.max_batch):
+                piece = windows[start:start + self.max_batch]
+                future = Future()
+                self._queue.append((piece, time.perf_counter(), future))
+                self._queued_windows += len(piece)
+                futures.append(future)
+            self._cond.notify()
+        with self._stats_lock:
+            self._totals["requests"] += 1
+        outputs = [f.result() for f in futures]
+        return {k: np.concatenate([o[k] for o in outputs]) for k in outputs[0]}
+
+    def metrics(self):
+        with self._stats_lock:
+            totals = dict(self._totals)
+            sizes = list(self._batch_sizes)
+            waits = list(self._waits_ms)
+        with self._cond:
+            queued = self._queued_windows
+        totals["busy_seconds"] = round(totals["busy_seconds"], 3)
+        return dict(
+            totals,
+            max_batch=self.max_batch,
+            max_wait_ms=self.max_wait_ms,
+            queued_windows=queued,
+            mean_batch_size=round(totals["windows"] / totals["batches"], 2) if totals["batches"] else None,
+            batch_size=_percentiles(sizes),
+            queue_wait_ms=_percentiles(waits),
+        )
+
+    # --- WORKER ---
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # Keep gathering until the batch is full or the oldest request has waited long enough
+                deadline = self._queue[0][1] + self.max_wait_ms / 1000.0
+                while self._queued_windows < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = []
+                size = 0
+                while self._queue and size + len(self._queue[0][0]) <= self.max_batch:
+                    item = self._queue.popleft()
+                    batch.append(item)
+                    size += len(item[0])
+                self._queued_windows -= size
+            self._run(batch, size)
+
+    def _run(self, batch, size):
+        started = time.perf_counter()
+        try:
+            outputs = self._predict(np.concatenate([windows for windows, _, _ in batch]))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        offset = 0
+        for windows, _, future in batch:
+            n = len(windows)
+            future.set_result({k: v[offset:offset + n] for k, v in outputs.items()})
+            offset += n
+
+        with self._stats_lock:
+            self._totals["batches"] += 1
+            self._totals["windows"] += size
+            self._totals["busy_seconds"] += finished - started
+            self._batch_sizes.append(size)
+            self._waits_ms.extend(1000.0 * (started - queued_at) for _, queued_at, _ in batch)
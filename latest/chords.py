@@ -0,0 +1,191 @@
+"""Chord extraction (Chordino / NNLS-Chroma, as used in app_v4-app_v6).
+
+extract_chords runs Chordino over the whole file on one core. For long tracks,
+extract_chords_parallel leaves out silent stretches (activity.py), splits the
+audio at low-energy points near every `chunk_seconds`, runs Chordino on the
+chunks in a process pool and stitches the segments back together (merging a
+chord that continues across a seam).
+
+    python latest/chords.py live_set.mp3 --workers 1 2 4 8
+
+compares the two on a file: wall time, speedup and how closely the chord
+labels agree with the single pass.
+"""
+import argparse
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from startup import lazy_import, resource
+
+CHUNK_SECONDS = 60.0
+# How far from each nominal boundary to look for a quiet split point
+SEARCH_SECONDS = 5.0
+# 'N' stretches shorter than this at a seam are chunk-edge artifacts, not real gaps
+SEAM_TOLERANCE = 0.75
+
+
+def chords_available():
+    """chord_extractor is optional; check for it without importing it."""
+    return importlib.util.find_spec("chord_extractor") is not None
+
+
+def _raw_segments(file_path):
+    """Chordino output as [(start, end, chord), ...], 'N' (no chord) included."""
+    extractors = lazy_import("chord_extractor.extractors")
+    # roll_on improves detection of chord changes
+    raw_chords = extractors.Chordino(roll_on=True).extract(file_path)
+    return [
+        (raw_chords[i].timestamp, raw_chords[i+1].timestamp, raw_chords[i].chord)
+        for i in range(len(raw_chords) - 1)
+    ]
+
+def _is_chord(label):
+    return label not in ['N', '']
+
+def extract_chords(file_path):
+    """Returns [(start, end, chord), ...] with 'N' (no chord) segments dropped."""
+    return [segment for segment in _raw_segments(file_path) if _is_chord(segment[2])]
+
+
+# --- PARALLEL EXTRACTION ---
+
+def find_split_points(y, sr, chunk_seconds=CHUNK_SECONDS, search_seconds=SEARCH_SECONDS, hop_length=512):
+    """Sample positions to cut at: the quietest frame (RMS) within search_seconds of each chunk boundary."""
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    rms = librosa.feature.rms(y=y, frame_length=2048, hop_length=hop_length)[0]
+    frames_per_chunk = chunk_seconds * sr / hop_length
+    search = int(search_seconds * sr / hop_length)
+    cuts = []
+    for k in range(1, int(len(rms) // frames_per_chunk) + 1):
+        centre = int(k * frames_per_chunk)
+        lo, hi = max(centre - search, 0), min(centre + search + 1, len(rms))
+        if hi - lo < 2 or len(rms) - centre < search:
+            break  # too close to the end for another chunk
+        cuts.append((lo + int(np.argmin(rms[lo:hi]))) * hop_length)
+    return cuts
+
+def _extract_chunk(path):
+    """Worker: Chordino segments of one chunk file, 'N' included, timed from the chunk start."""
+    return _raw_segments(path)
+
+def _pool(workers):
+    # spawn: the UI and API run threads, which fork does not copy safely
+    return resource(f"chord_pool_{workers}", lambda: ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context("spawn")
+    ))
+
+def stitch(chunks, tolerance=SEAM_TOLERANCE):
+    """Joins per-chunk segments [(offset, duration, segments), ...] into one chord track.
+
+    Short 'N' stretches at a seam are absorbed, and the same chord on both sides
+    of a seam becomes one segment. Returns [(start, end, chord), ...] without 'N'.
+    """
+    merged = []
+    for offset, duration, segments in chunks:
+        segments = [(offset + start, offset + end, chord) for start, end, chord in segments]
+        if segments and segments[-1][1] < offset + duration:
+            # Chordino reports changes only; hold the last label to the chunk end
+            last = segments[-1]
+            segments[-1] = (last[0], offset + duration, last[2])
+        # Drop edge 'N' artifacts on both sides of the seam
+        if merged and segments and not _is_chord(segments[0][2]) and segments[0][1] - segments[0][0] < tolerance:
+            segments = segments[1:]
+            if segments:
+                segments[0] = (offset, segments[0][1], segments[0][2])
+        if merged and not _is_chord(merged[-1][2]) and merged[-1][1] - merged[-1][0] < tolerance and len(merged) > 1:
+            merged.pop()
+            merged[-1] = (merged[-1][0], offset, merged[-1][2])
+        if merged and segments and merged[-1][2] == segments[0][2]:
+            merged[-1] = (merged[-1][0], segments[0][1], merged[-1][2])
+            segments = segments[1:]
+        merged.extend(segments)
+    return [segment for segment in merged if _is_chord(segment[2])]
+
+def extract_chords_parallel(file_path, chunk_seconds=CHUNK_SECONDS, workers=None, extractor=_extract_chunk,
+                            skip_silence=True):
+    """Same output as extract_chords, computed on chunks across a process pool.
+
+    With skip_silence, silent and noise-only stretches (see activity.py) are cut
+    out before Chordino runs and the segments are mapped back to file time.
+    Audio shorter than two chunks (or a single worker) is not split.
+    """
+    workers = workers or os.cpu_count() or 1
+    librosa = lazy_import("librosa")
+    sf = lazy_import("soundfile")
+    short = workers < 2 or librosa.get_duration(path=file_path) < 2 * chunk_seconds
+    if short and not skip_silence:
+        return extract_chords(file_path)
+    y, sr = librosa.load(file_path, sr=None, mono=True)
+    timeline = lazy_import("activity").detect_activity(y, sr) if skip_silence else None
+    if timeline is not None and timeline.worth_skipping():
+        if not len(timeline.regions):
+            return []
+        y = timeline.compact(y, sr)
+    elif short:
+        return extract_chords(file_path)  # nothing to skip or split
+    else:
+        timeline = None
+
+    split = workers >= 2 and len(y) / sr >= 2 * chunk_seconds
+    bounds = [0] + (find_split_points(y, sr, chunk_seconds) if split else []) + [len(y)]
+    tmp_dir = tempfile.mkdtemp(prefix="chordia_chunks_")
+    try:
+        paths = []
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            path = os.path.join(tmp_dir, f"chunk_{i:04d}.wav")
+            sf.write(path, y[start:end], sr)
+            paths.append(path)
+        results = _pool(workers).map(extractor, paths) if split else [extractor(paths[0])]
+        chunks = [
+            (start / sr, (end - start) / sr, segments)
+            for (start, end), segments in zip(zip(bounds, bounds[1:]), results)
+        ]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    chords = stitch(chunks)
+    return timeline.segments(chords) if timeline is not None else chords
+
+
+# --- BENCHMARK ---
+
+def agreement(a, b, step=0.1):
+    """Fraction of time (sampled every step seconds) where two chord tracks give the same label."""
+    np = lazy_import("numpy")
+    intervals = lazy_import("intervals")
+    end = max([s[1] for s in a] + [s[1] for s in b] + [0.0])
+    times = np.arange(0, end, step)
+    if not len(times):
+        return 1.0
+    labels_a = intervals.IntervalIndex.from_segments(a).labels_at(times, missing="N")
+    labels_b = intervals.IntervalIndex.from_segments(b).labels_at(times, missing="N")
+    return float(np.mean(labels_a == labels_b))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single-pass and parallel chunked Chordino")
+    parser.add_argument("audio")
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1])
+    parser.add_argument("--chunk", type=float, default=CHUNK_SECONDS, help="nominal chunk length (s)")
+    parser.add_argument("--keep-silence", action="store_true", help="do not skip silent stretches")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    reference = extract_chords(args.audio)
+    single = time.perf_counter() - started
+    print(f"single pass: {single:.1f}s, {len(reference)} chords ({os.cpu_count()} cores)")
+    for workers in args.workers:
+        list(_pool(workers).map(time.sleep, [0.2] * workers))  # start the workers outside the timing
+        started = time.perf_counter()
+        chords = extract_chords_parallel(args.audio, args.chunk, workers, skip_silence=not args.keep_silence)
+        elapsed = time.perf_counter() - started
+        print(f"{workers:>2} workers: {elapsed:.1f}s, speedup {single / elapsed:.2f}x, "
+              f"{len(chords)} chords, label agreement {agreement(reference, chords):.1%}")
+
+
+if __name__ == "__main__":
+    main()
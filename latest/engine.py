@@ -0,0 +1,179 @@
+"""Basic Pitch inference helpers shared by the UI and the streaming/batch tools.
+
+Everything heavy (numpy, TensorFlow via basic_pitch) is imported on first use so
+importing this module does not slow down the first page render. When
+CHORDIA_MODEL_SOCKET is set, transcription is sent to the shared model server
+(model_server.py) and basic_pitch/TensorFlow are never imported in this process.
+"""
+import io
+import os
+
+from startup import lazy_import, resource
+
+# Mirrors basic_pitch.constants.AUDIO_SAMPLE_RATE; importing basic_pitch pulls in TensorFlow
+SAMPLE_RATE = 22050
+# Same overlap Basic Pitch's run_inference uses between consecutive windows
+N_OVERLAPPING_FRAMES = 30
+# Windows a single transcription hands to the batcher at a time. Kept below
+# MAX_BATCH so concurrent jobs interleave and fill batches together.
+WINDOWS_PER_CALL = 8
+MAX_BATCH = int(os.environ.get("CHORDIA_MAX_BATCH", "32"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("CHORDIA_MAX_BATCH_WAIT_MS", "10"))
+
+
+def load_basic_pitch_model():
+    inference = lazy_import("basic_pitch.inference")
+    basic_pitch = lazy_import("basic_pitch")
+    return inference.Model(basic_pitch.ICASSP_2022_MODEL_PATH)
+
+def get_model():
+    """Loads the Basic Pitch model once per process (shared by all sessions)."""
+    return resource("basic_pitch_model", load_basic_pitch_model)
+
+def model_server_socket():
+    return os.environ.get("CHORDIA_MODEL_SOCKET") or None
+
+def get_model_client():
+    model_server = lazy_import("model_server")
+    return resource("model_client", lambda: model_server.ModelClient(model_server_socket()))
+
+def constants():
+    """basic_pitch.constants (AUDIO_SAMPLE_RATE, AUDIO_N_SAMPLES, FFT_HOP, ...)."""
+    return lazy_import("basic_pitch.constants")
+
+def frames_to_seconds(frame):
+    c = constants()
+    return frame * c.FFT_HOP / c.AUDIO_SAMPLE_RATE
+
+def _min_note_frames(minimum_note_length_ms):
+    c = constants()
+    return int(round(minimum_note_length_ms / 1000 * (c.AUDIO_SAMPLE_RATE / c.FFT_HOP)))
+
+
+# --- MODEL FORWARD PASS ---
+
+def predict_windows(model, windows):
+    """Forward pass on (n, AUDIO_N_SAMPLES) windows.
+
+    Returns {'note', 'onset', 'contour'} activations shaped (n, frames, bins).
+    """
+    np = lazy_import("numpy")
+    x = np.asarray(windows, dtype=np.float32).reshape(len(windows), -1, 1)
+    return model.predict(x)
+
+def get_batcher():
+    """Process-wide micro-batcher in front of the in-process model."""
+    batching = lazy_import("batching")
+    return resource("basic_pitch_batcher", lambda: batching.MicroBatcher(
+        lambda windows: predict_windows(get_model(), windows),
+        max_batch=MAX_BATCH, max_wait_ms=MAX_BATCH_WAIT_MS,
+    ))
+
+def local_predictor():
+    return get_batcher().predict
+
+def get_predictor():
+    """Callable windows -> activations: the model server if configured, else the in-process model."""
+    if model_server_socket():
+        return get_model_client().predict
+    return local_predictor()
+
+def batching_metrics():
+    """Batch-size / queue-wait metrics from wherever inference runs for this process."""
+    if model_server_socket():
+        return get_model_client().stats().get("batching")
+    return get_batcher().metrics()
+
+def window_audio(audio):
+    """Splits mono SAMPLE_RATE audio into Basic Pitch's overlapping model windows.
+
+    Returns (windows shaped (n, AUDIO_N_SAMPLES), original_length).
+    """
+    np = lazy_import("numpy")
+    c = constants()
+    overlap_len = N_OVERLAPPING_FRAMES * c.FFT_HOP
+    hop_size = c.AUDIO_N_SAMPLES - overlap_len
+    audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+    padded = np.concatenate([np.zeros(overlap_len // 2, dtype=np.float32), audio])
+    starts = range(0, len(padded), hop_size)
+    windows = np.zeros((len(starts), c.AUDIO_N_SAMPLES), dtype=np.float32)
+    for i, start in enumerate(starts):
+        chunk = padded[start:start + c.AUDIO_N_SAMPLES]
+        windows[i, :len(chunk)] = chunk
+    return windows, len(audio)
+
+def unwrap_windows(outputs, original_length):
+    """Stitches per-window activations back into (frames, bins) matrices for the whole track."""
+    inference = lazy_import("basic_pitch.inference")
+    return {k: inference.unwrap_output(v, original_length, N_OVERLAPPING_FRAMES) for k, v in outputs.items()}
+
+
+# --- NOTE DECODING ---
+
+def decode_notes(note, onset, onset_threshold=0.5, frame_threshold=0.3,
+                 minimum_note_length_ms=127.70, melodia_trick=True,
+                 minimum_frequency=None, maximum_frequency=None):
+    """Basic Pitch's own polyphonic note decoding on (frames, 88) activations.
+
+    Returns [(start_frame, end_frame, pitch_midi, amplitude), ...].
+    """
+    np = lazy_import("numpy")
+    note_creation = lazy_import("basic_pitch.note_creation")
+    # Copies: the decoder may zero out energy in place. errstate: onset inference
+    # divides by the max frame difference, which is 0 on silent input.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return note_creation.output_to_notes_polyphonic(
+            np.array(note, copy=True),
+            np.array(onset, copy=True),
+            onset_thresh=onset_threshold,
+            frame_thresh=frame_threshold,
+            min_note_len=_min_note_frames(minimum_note_length_ms),
+            infer_onsets=True,
+            max_freq=maximum_frequency,
+            min_freq=minimum_frequency,
+            melodia_trick=melodia_trick,
+        )
+
+
+# --- FULL TRANSCRIPTION ---
+
+def load_audio(audio_path):
+    librosa = lazy_import("librosa")
+    y, _ = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True)
+    return y
+
+def transcribe_pcm(audio, predict=None, onset_threshold=0.5, frame_threshold=0.3,
+                   minimum_note_length_ms=127.70, melodia_trick=True):
+    """Basic Pitch transcription of mono SAMPLE_RATE audio, same steps as basic_pitch.predict.
+
+    Returns (note_events, midi_bytes) with note_events as
+    [(start_s, end_s, pitch_midi, amplitude), ...] sorted by start.
+    """
+    np = lazy_import("numpy")
+    note_creation = lazy_import("basic_pitch.note_creation")
+    predict = predict or get_predictor()
+
+    windows, original_length = window_audio(audio)
+    outputs = [predict(windows[i:i + WINDOWS_PER_CALL]) for i in range(0, len(windows), WINDOWS_PER_CALL)]
+    merged = {k: np.concatenate([o[k] for o in outputs]) for k in outputs[0]}
+    midi_data, note_events = note_creation.model_output_to_notes(
+        unwrap_windows(merged, original_length),
+        onset_thresh=onset_threshold,
+        frame_thresh=frame_threshold,
+        min_note_len=_min_note_frames(minimum_note_length_ms),
+        melodia_trick=melodia_trick,
+    )
+    buffer = io.BytesIO()
+    midi_data.write(buffer)
+    events = sorted((float(e[0]), float(e[1]), int(e[2]), float(e[3])) for e in note_events)
+    return events, buffer.getvalue()
+
+def transcribe_audio(audio, **options):
+    """Transcribes PCM on the model server if configured, otherwise in this process."""
+    if model_server_socket():
+        return get_model_client().transcribe(audio, **options)
+    return transcribe_pcm(audio, **options)
+
+def transcribe_file(audio_path, **options):
+    """Full-file Basic Pitch transcription without writing anything to disk."""
+    return transcribe_audio(load_audio(audio_path), **options)
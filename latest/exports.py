@@ -0,0 +1,224 @@
+"""On-demand, memoized export files for one analysis result.
+
+Nothing is generated until a download is requested (Streamlit calls these
+methods only when a download button is clicked). Each file is built at most
+once per analysis and reused afterwards, including inside the zip bundle.
+"""
+import csv
+import io
+import threading
+import zipfile
+
+import numpy as np
+
+import sheet
+import transpose
+from intervals import IntervalIndex
+from note_store import NOTE_NAMES
+
+
+class AnalysisExports:
+    """Exports for one analysis: MIDI, note CSV/TXT, chord CSV and a zip bundle of all of them.
+
+    chords may be a list of (start, end, chord) or a zero-argument callable that
+    produces one (so expensive chord extraction also only runs on request);
+    midi_bytes may likewise be a callable.
+    cache is where built files are memoized: a plain dict by default, or an
+    artifacts.ArtifactScope so they count against the artifact store's quotas.
+    tuning/capo (see transpose.TUNINGS) add guitar/bass tab exports; arranged()
+    gives the same exports in another key.
+    """
+
+    def __init__(self, table, midi_bytes, chords=None, name="chordia", cache=None,
+                 tuning=None, capo=0, _prefix="export_"):
+        self.table = table
+        self.midi_bytes = midi_bytes
+        self.name = name
+        self.tuning = tuning
+        self.capo = capo
+        self._chords = chords
+        self._cache = {} if cache is None else cache
+        self._prefix = _prefix
+        self._tabs_key = f"{tuning}_capo{capo}"
+        self._lock = threading.RLock()  # bundle() reuses the other memoized exports
+
+    def arranged(self, semitones=0, tuning=None, capo=0):
+        """These exports transposed by semitones and/or with tabs for a tuning and capo.
+
+        Built from the cached notes, MIDI and chords only; the result shares this
+        instance's cache, so each key/tuning combination is generated once.
+        """
+        if not semitones:
+            return AnalysisExports(self.table, self.midi_bytes, self._chords, self.name, self._cache,
+                                   tuning, capo, self._prefix)
+        chords = self._chords
+        if chords is not None:
+            extracted = self.cached_chords()
+            if extracted is not None:
+                chords = transpose.transpose_chords(extracted, semitones)
+            else:
+                chords = lambda: transpose.transpose_chords(self.chords(), semitones)
+        midi = lambda: transpose.transpose_midi(self.midi(), semitones)
+        return AnalysisExports(self.table.transposed(semitones), midi, chords, self.name, self._cache,
+                               tuning, capo, f"{self._prefix}{semitones:+d}_")
+
+    def _memo(self, key, build):
+        key = self._prefix + key
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                value = build()
+                if isinstance(self._cache, dict):
+                    self._cache[key] = value
+                else:
+                    self._cache.put(key, value)
+            return value
+
+    def midi(self):
+        if callable(self.midi_bytes):
+            return self._memo("midi", self.midi_bytes)
+        return self.midi_bytes
+
+    def notes_csv(self):
+        return self._memo("notes_csv", self._build_notes_csv)
+
+    def notes_txt(self):
+        return self._memo("notes_txt", self._build_notes_txt)
+
+    def chords(self):
+        if self._chords is None:
+            return None
+        return self._memo("chords", self._chords if callable(self._chords) else lambda: self._chords)
+
+    def cached_chords(self):
+        """Chords if they have already been extracted, without triggering extraction."""
+        if self._chords is None:
+            return None
+        if not callable(self._chords):
+            return self._chords
+        return self._cache.get(self._prefix + "chords")
+
+    def chord_index(self):
+        if self._chords is None:
+            return None
+        return self._memo("chord_index", lambda: IntervalIndex.from_segments(self.chords()))
+
+    def chords_csv(self):
+        if self._chords is None:
+            return None
+        return self._memo("chords_csv", self._build_chords_csv)
+
+    def chord_notes_csv(self):
+        """One row per chord with the notes that start inside it."""
+        if self._chords is None:
+            return None
+        return self._memo("chord_notes_csv", self._build_chord_notes_csv)
+
+    def tabs_csv(self):
+        if self.tuning is None:
+            return None
+        return self._memo(f"tabs_csv_{self._tabs_key}", self._build_tabs_csv)
+
+    def tabs_txt(self):
+        if self.tuning is None:
+            return None
+        return self._memo(f"tabs_txt_{self._tabs_key}", self._build_tabs_txt)
+
+    def musicxml(self):
+        return self._memo("musicxml", lambda: self._build_sheet(sheet.write_musicxml))
+
+    def abc(self):
+        return self._memo("abc", lambda: self._build_sheet(sheet.write_abc))
+
+    def bundle(self):
+        return self._memo(f"bundle_{self._tabs_key}" if self.tuning else "bundle", self._build_bundle)
+
+    # --- BUILDERS ---
+
+    def _build_notes_csv(self):
+        t = self.table
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["start", "end", "pitch", "note", "velocity"])
+        writer.writerows(zip(
+            np.round(t.start.astype(np.float64), 3).tolist(),
+            np.round(t.end.astype(np.float64), 3).tolist(),
+            t.pitch.tolist(),
+            NOTE_NAMES[t.pitch].tolist(),
+            t.velocity.tolist(),
+        ))
+        return out.getvalue().encode("utf-8")
+
+    def _build_notes_txt(self):
+        # Formatting notes for easy reading on an instrument
+        t = self.table
+        starts = np.round(t.start.astype(np.float64), 2).tolist()
+        return "\n".join(f"{s}s: {n}" for s, n in zip(starts, NOTE_NAMES[t.pitch].tolist())).encode("utf-8")
+
+    def _build_chords_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["start", "end", "chord"])
+        writer.writerows((round(start, 3), round(end, 3), chord) for start, end, chord in self.chords())
+        return out.getvalue().encode("utf-8")
+
+    def _build_tabs_csv(self):
+        t = self.table
+        string, fret = transpose.tab_positions(t.pitch, self.tuning, self.capo)
+        names = np.array(transpose.string_names(self.tuning) + [""])
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["start", "end", "note", "string", "fret"])
+        writer.writerows(zip(
+            np.round(t.start.astype(np.float64), 3).tolist(),
+            np.round(t.end.astype(np.float64), 3).tolist(),
+            NOTE_NAMES[t.pitch].tolist(),
+            names[string].tolist(),  # -1 (unplayable) picks the trailing ""
+            np.where(fret >= 0, fret, "").tolist(),
+        ))
+        return out.getvalue().encode("utf-8")
+
+    def _build_tabs_txt(self):
+        starts = np.round(self.table.start.astype(np.float64), 2).tolist()
+        labels = transpose.tab_labels(self.table.pitch, self.tuning, self.capo)
+        header = f"Tuning: {self.tuning}" + (f", capo {self.capo}" if self.capo else "")
+        return "\n".join([header] + [f"{s}s: {label}" for s, label in zip(starts, labels)]).encode("utf-8")
+
+    def _build_sheet(self, write):
+        out = io.StringIO()
+        write(self.table, out, title=self.name)
+        return out.getvalue().encode("utf-8")
+
+    def _build_chord_notes_csv(self):
+        index = self.chord_index()
+        groups = index.group(self.table.start)
+        names = NOTE_NAMES[self.table.pitch]
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(["start", "end", "chord", "notes"])
+        for i, (start, end, chord) in enumerate(zip(index.start.tolist(), index.end.tolist(), index.labels)):
+            notes = groups.get(i)
+            writer.writerow([round(start, 3), round(end, 3), chord, " ".join(names[notes]) if notes is not None else ""])
+        return out.getvalue().encode("utf-8")
+
+    def _build_bundle(self):
+        files = {
+            f"{self.name}.mid": self.midi(),
+            f"{self.name}_notes.csv": self.notes_csv(),
+            f"{self.name}_notes.txt": self.notes_txt(),
+            f"{self.name}.musicxml": self.musicxml(),
+        }
+        if self.tuning is not None:
+            files[f"{self.name}_tabs.csv"] = self.tabs_csv()
+            files[f"{self.name}_tabs.txt"] = self.tabs_txt()
+        if self._chords is not None:
+            try:
+                files[f"{self.name}_chords.csv"] = self.chords_csv()
+                files[f"{self.name}_chord_notes.csv"] = self.chord_notes_csv()
+            except Exception as e:
+                files[f"{self.name}_chords_error.txt"] = f"Chord extraction failed: {e}".encode("utf-8")
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for filename, data in files.items():
+                archive.writestr(filename, data)
+        return buffer.getvalue()
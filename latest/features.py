@@ -0,0 +1,235 @@
+"""Shared store of spectral features (PCM, STFT, mel, CQT, chroma) as memory-mapped .npy files.
+
+Features are keyed by a hash of the audio file plus the transform parameters,
+so the spectrogram shown in the UI, the transcription engines and any later
+analysis of the same audio share one computation. Related transforms are
+derived from what is already stored instead of starting from the audio again:
+
+    pcm -> stft -> mel
+    pcm -> cqt  -> chroma
+
+Arrays are written once (atomically) and opened read-only with mmap_mode="r",
+so readers share the OS page cache instead of each holding a copy, and other
+processes on the host (UI replicas, the API) reuse the files too.
+
+Configured with CHORDIA_FEATURE_DIR and CHORDIA_FEATURE_DISK_MB.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from startup import lazy_import, resource
+
+SAMPLE_RATE = 22050
+DEFAULTS = {
+    "pcm": {"sr": SAMPLE_RATE},
+    "stft": {"sr": SAMPLE_RATE, "n_fft": 2048, "hop_length": 512},
+    "mel": {"sr": SAMPLE_RATE, "n_fft": 2048, "hop_length": 512, "n_mels": 128},
+    "cqt": {"sr": SAMPLE_RATE, "hop_length": 512, "n_bins": 84, "bins_per_octave": 12},
+    # Folded from the default CQT above, so a cached chroma reuses it instead of storing a second one
+    "chroma": {"sr": SAMPLE_RATE, "hop_length": 512, "n_bins": 84, "bins_per_octave": 12, "n_chroma": 12},
+}
+
+
+def audio_key(data):
+    """Content hash identifying an audio file (bytes, or a path to read)."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(data).hexdigest()[:32]
+    digest = hashlib.sha256()
+    with open(data, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+# --- TRANSFORMS ---
+# Each takes the store, the audio key and the full parameter set, and fetches
+# its input through the store so intermediate results are shared too.
+
+def _pcm(store, key, sr):
+    librosa = lazy_import("librosa")
+    y, _ = librosa.load(store.source(key), sr=sr, mono=True)
+    return y
+
+def _stft(store, key, sr, n_fft, hop_length):
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    y = store.get(key, "pcm", sr=sr)
+    return np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+
+def _mel(store, key, sr, n_fft, hop_length, n_mels):
+    # Same as librosa.feature.melspectrogram(y=...) with these parameters, from the stored STFT
+    librosa = lazy_import("librosa")
+    S = store.get(key, "stft", sr=sr, n_fft=n_fft, hop_length=hop_length)
+    return librosa.feature.melspectrogram(S=S ** 2, sr=sr, n_fft=n_fft, n_mels=n_mels)
+
+def _cqt(store, key, sr, hop_length, n_bins, bins_per_octave):
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    y = store.get(key, "pcm", sr=sr)
+    return np.abs(librosa.cqt(y, sr=sr, hop_length=hop_length, n_bins=n_bins, bins_per_octave=bins_per_octave))
+
+def _chroma(store, key, sr, hop_length, n_bins, bins_per_octave, n_chroma):
+    # librosa.feature.chroma_cqt from the stored CQT (shared with the "cqt" feature at the defaults)
+    librosa = lazy_import("librosa")
+    C = store.get(key, "cqt", sr=sr, hop_length=hop_length, n_bins=n_bins, bins_per_octave=bins_per_octave)
+    return librosa.feature.chroma_cqt(C=C, sr=sr, hop_length=hop_length, n_chroma=n_chroma,
+                                      bins_per_octave=bins_per_octave)
+
+TRANSFORMS = {"pcm": _pcm, "stft": _stft, "mel": _mel, "cqt": _cqt, "chroma": _chroma}
+
+
+class FeatureStore:
+    def __init__(self, root, max_disk_bytes=2 * 2**30):
+        self.root = root
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(root, exist_ok=True)
+        self._sources = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "computed": 0}
+        self._seconds = {}
+        self._local = threading.local()  # time spent in nested (input) transforms
+
+    def add_audio(self, path, key=None):
+        """Registers an audio file and returns its key (pass key if the hash is already known)."""
+        key = key or audio_key(path)
+        with self._lock:
+            self._sources[key] = path
+        return key
+
+    def source(self, key):
+        with self._lock:
+            path = self._sources.get(key)
+        if path is None or not os.path.exists(path):
+            raise KeyError(f"no audio registered for {key}; call add_audio first")
+        return path
+
+    def path(self, key, kind, **params):
+        params = self._params(kind, params)
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+        return os.path.join(self.root, key, f"{kind}-{digest}.npy")
+
+    def get(self, key, kind, **params):
+        """The transform as a read-only memory-mapped array, computing (and deriving) it on first use."""
+        np = lazy_import("numpy")
+        params = self._params(kind, params)
+        path = self.path(key, kind, **params)
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            if os.path.exists(path):
+                with self._lock:
+                    self._counters["hits"] += 1
+                try:
+                    os.utime(os.path.dirname(path))  # recency for pruning
+                except OSError:
+                    pass
+                return np.load(path, mmap_mode="r")
+            outer = getattr(self._local, "nested", 0.0)
+            self._local.nested = 0.0
+            started = time.perf_counter()
+            try:
+                array = np.ascontiguousarray(TRANSFORMS[kind](self, key, **params), dtype=np.float32)
+            finally:
+                elapsed = time.perf_counter() - started
+                own = elapsed - self._local.nested
+                self._local.nested = outer + elapsed
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._counters["computed"] += 1
+                self._seconds[kind] = self._seconds.get(kind, 0.0) + own
+        self._prune(keep=key)
+        return np.load(path, mmap_mode="r")
+
+    # --- NAMED RESULTS ---
+    # Anything else derived from one audio file (e.g. pipeline stage outputs), kept
+    # next to its features: shared across processes and runs, pruned with them.
+
+    def load(self, key, name):
+        """A saved result (arrays memory-mapped, anything else from JSON), or None."""
+        np = lazy_import("numpy")
+        base = os.path.join(self.root, key, name)
+        for path in (base + ".npy", base + ".json"):
+            if os.path.exists(path):
+                with self._lock:
+                    self._counters["hits"] += 1
+                try:
+                    os.utime(os.path.dirname(path))
+                except OSError:
+                    pass
+                if path.endswith(".npy"):
+                    return np.load(path, mmap_mode="r")
+                with open(path) as f:
+                    return json.load(f)
+        return None
+
+    def save(self, key, name, value):
+        """Saves a result for audio key: an array as .npy, anything else as JSON."""
+        np = lazy_import("numpy")
+        is_array = isinstance(value, np.ndarray)
+        path = os.path.join(self.root, key, name + (".npy" if is_array else ".json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb" if is_array else "w") as f:
+            if is_array:
+                np.save(f, value)
+            else:
+                # numpy scalars (e.g. in engine output) as plain numbers
+                json.dump(value, f, default=lambda item: item.item())
+        os.replace(tmp_path, path)
+        self._prune(keep=key)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._counters, compute_seconds={k: round(v, 3) for k, v in self._seconds.items()},
+                        disk_bytes=self._disk_usage()[0], max_disk_bytes=self.max_disk_bytes)
+
+    # --- INTERNALS ---
+
+    @staticmethod
+    def _params(kind, params):
+        if kind not in DEFAULTS:
+            raise ValueError(f"unknown feature {kind!r}; expected one of {sorted(DEFAULTS)}")
+        unknown = set(params) - set(DEFAULTS[kind])
+        if unknown:
+            raise TypeError(f"unexpected parameters for {kind}: {sorted(unknown)}")
+        return dict(DEFAULTS[kind], **params)
+
+    def _disk_usage(self):
+        """(total bytes, [(last use, bytes, directory), ...]) over the per-audio directories."""
+        total, dirs = 0, []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            total += size
+            dirs.append((entry.stat().st_mtime, size, entry.path))
+        return total, dirs
+
+    def _prune(self, keep):
+        """Drops the least recently used audio's features while over the disk quota."""
+        total, dirs = self._disk_usage()
+        for _, size, path in sorted(dirs):
+            if total <= self.max_disk_bytes:
+                break
+            if os.path.basename(path) == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def get_feature_store():
+    """Process-wide feature store (the files themselves are shared by every process on the host)."""
+    return resource("feature_store", lambda: FeatureStore(
+        os.environ.get("CHORDIA_FEATURE_DIR", os.path.join(tempfile.gettempdir(), "chordia-features")),
+        max_disk_bytes=int(float(os.environ.get("CHORDIA_FEATURE_DISK_MB", "2048")) * 2**20),
+    ))
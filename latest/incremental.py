@@ -0,0 +1,359 @@
+"""Incremental re-transcription of trimmed, extended or lightly edited re-uploads.
+
+Every analysis leaves behind, per audio file and analysis settings ("variant"):
+
+    bands   log energies of 33 bands per spectrogram frame (from the stored mel)
+    events  the note events, and the MIDI bytes
+
+A new upload is first correlated with each earlier one as a whole, at a
+coarse time resolution (one FFT): that rules out unrelated audio and yields a
+few candidate time shifts (one per stretch that moved, e.g. two around an
+insert). The upload is then cut into blocks of BLOCK_SECONDS; a block's
+fingerprint is its band-energy pattern, scored by normalized correlation only
+at lags close to the candidates, which holds up under re-encoding, gain
+changes and shifts that are not a whole number of frames. Alignment stays
+linear in the track length. Runs of blocks matched at the same shift reuse
+the earlier notes (moved by the shift, refined to below a frame); only the
+blocks that did not match, plus a little context, go through the engine.
+Re-analysis cost follows the size of the edit, not the length of the song.
+"""
+import io
+
+from startup import lazy_import
+
+BLOCK_SECONDS = 2.0
+# Whole-track search: frames averaged per step, and how many shifts it proposes
+COARSE_FRAMES = 4
+CANDIDATES = 8
+# Proposed shifts scoring below this share of the best one are not tried
+MIN_PEAK = 0.3
+# Below this whole-track similarity an earlier upload is not aligned at all
+# (unrelated audio: ~0.05; 30 s reused in a 5.5 min upload: ~0.17)
+MIN_SIMILARITY = 0.1
+# Block lags tried on each side of a proposed shift (covers the coarse step)
+SEARCH_FRAMES = 2 * COARSE_FRAMES
+# Correlation above which a block counts as the same audio (unrelated music: < 0.5)
+MIN_CORRELATION = 0.9
+# The previous block's shift is kept when it scores this close to the best one
+# (repeated bars would otherwise scatter a run across several shifts)
+STICKINESS = 0.02
+# Matches need this many consecutive blocks at one shift; single blocks of
+# common patterns (a scale run, a repeated chord) also turn up in unrelated audio
+MIN_RUN = 2
+# Blocks whose bands vary less than this (silence, a held drone) cannot be correlated
+MIN_SPREAD = 1e-3
+# Audio transcribed on each side of a changed region, so notes at its edges get their attack
+CONTEXT_SECONDS = 1.0
+# Earlier analyses per variant kept as alignment candidates
+HISTORY = 8
+N_BANDS = 33
+OWNER = "incremental"
+
+
+# --- FINGERPRINTS ---
+
+def band_energies(mel, n_bands=N_BANDS):
+    """(frames, n_bands) float32 log energies of mel bins grouped into n_bands bands (~300 Hz-5 kHz).
+
+    Scaled to the loudest band, so a gain change leaves them (almost) unchanged.
+    """
+    np = lazy_import("numpy")
+    mel = np.asarray(mel)
+    lo, hi = int(0.12 * mel.shape[0]), int(0.7 * mel.shape[0])
+    edges = np.linspace(lo, hi, n_bands + 1).astype(int)
+    bands = np.add.reduceat(mel[lo:hi], edges[:-1] - lo, axis=0)
+    return np.ascontiguousarray(np.log1p(1e3 * bands / max(float(bands.max()), 1e-12)).T, dtype=np.float32)
+
+def blocks(n_frames, block):
+    """[(start, stop), ...] frame ranges; a short tail joins the block before it."""
+    starts = list(range(0, n_frames, block))
+    if len(starts) > 1 and n_frames - starts[-1] < block // 2:
+        starts.pop()
+    return list(zip(starts, starts[1:] + [n_frames]))
+
+
+# --- ALIGNMENT ---
+
+def _coarse(bands, factor=COARSE_FRAMES):
+    np = lazy_import("numpy")
+    n = len(bands) // factor * factor
+    coarse = np.asarray(bands[:n], dtype=np.float64).reshape(-1, factor, bands.shape[1]).mean(axis=1)
+    return coarse - coarse.mean(axis=0)
+
+def candidate_shifts(new_bands, old_bands, factor=COARSE_FRAMES, count=CANDIDATES):
+    """(similarity, [frame shift, ...]): one correlation of the whole tracks at a coarse resolution.
+
+    similarity is the best correlation normalized by both tracks' energy (1 for
+    the same audio, a share of it for partial overlaps); the shifts are its
+    strongest peaks, best first.
+    """
+    np = lazy_import("numpy")
+    a, b = _coarse(new_bands, factor), _coarse(old_bands, factor)
+    energy = float(np.sqrt((a ** 2).sum() * (b ** 2).sum()))
+    if not len(a) or not len(b) or energy <= 0:
+        return 0.0, []
+    size = 1 << (len(a) + len(b)).bit_length()
+    products = np.fft.irfft(
+        (np.fft.rfft(a, n=size, axis=0) * np.conj(np.fft.rfft(b, n=size, axis=0))).sum(axis=1), n=size
+    )
+    # Lag k (new index - old index) sits at k, negative lags wrap around
+    lags = np.arange(-(len(b) - 1), len(a))
+    values = np.concatenate([products[size - (len(b) - 1):], products[:len(a)]])
+    best = float(values.max())
+    peaks = np.flatnonzero(np.r_[True, values[1:] >= values[:-1]] & np.r_[values[:-1] >= values[1:], True])
+    peaks = peaks[values[peaks] >= MIN_PEAK * best]
+    top = peaks[np.argsort(values[peaks])[::-1][:count]]
+    return best / energy, [int(lags[i]) * factor for i in top]
+
+def _scores(new, old, spans, lags):
+    """(blocks, lags) normalized correlation of every block with old at every lag in lags."""
+    np = lazy_import("numpy")
+    starts = np.array([start for start, _ in spans])
+    stops = np.array([stop for _, stop in spans])
+    cells = (stops - starts) * new.shape[1]
+    sx = np.add.reduceat(new.sum(axis=1), starts)
+    sxx = np.add.reduceat((new ** 2).sum(axis=1), starts)
+    old_sum, old_squares = old.sum(axis=1), (old ** 2).sum(axis=1)
+    scores = np.full((len(spans), len(lags)), -np.inf)
+    for j, lag in enumerate(lags):
+        lo, hi = max(lag, 0), min(len(new), len(old) + lag)  # new frames with an old frame at this lag
+        if hi <= lo:
+            continue
+        per_frame = np.zeros((3, len(new)))
+        per_frame[0, lo:hi] = np.einsum("ij,ij->i", new[lo:hi], old[lo - lag:hi - lag])
+        per_frame[1, lo:hi] = old_sum[lo - lag:hi - lag]
+        per_frame[2, lo:hi] = old_squares[lo - lag:hi - lag]
+        sxy, sy, syy = np.add.reduceat(per_frame, starts, axis=1)
+        spread = np.maximum(sxx - sx ** 2 / cells, 0) * np.maximum(syy - sy ** 2 / cells, 0)
+        valid = (starts >= lo) & (stops <= hi) & (spread > 0)
+        scores[valid, j] = (sxy - sx * sy / cells)[valid] / np.sqrt(spread[valid])
+    return scores
+
+def align(new_bands, old_bands, frame_seconds, block_seconds=BLOCK_SECONDS, min_correlation=MIN_CORRELATION,
+          shifts=None):
+    """[(start, stop, shift or None), ...] per block of new_bands: the frame shift (new - old)
+    at which it matches old_bands, kept only in runs of at least MIN_RUN blocks.
+
+    Only lags near shifts (default: candidate_shifts) are tried.
+    """
+    np = lazy_import("numpy")
+    new, old = np.asarray(new_bands, dtype=np.float64), np.asarray(old_bands, dtype=np.float64)
+    block = max(int(round(block_seconds / frame_seconds)), 8)
+    spans = blocks(len(new), block)
+    if shifts is None:
+        _, shifts = candidate_shifts(new, old)
+    lags = sorted({shift + offset for shift in shifts for offset in range(-SEARCH_FRAMES, SEARCH_FRAMES + 1)})
+    column = {lag: j for j, lag in enumerate(lags)}
+    scores = _scores(new, old, spans, lags) if lags and spans else np.zeros((len(spans), 0))
+
+    # Blocks with structure: best shift by correlation; flat blocks (silence, drones) are decided later
+    matched, flat = [], []
+    previous = None
+    for i, (start, stop) in enumerate(spans):
+        x = new[start:stop]
+        is_flat = float(x.std()) < MIN_SPREAD
+        shift = None
+        if not is_flat and len(lags):
+            j = int(np.argmax(scores[i]))
+            if previous is not None and scores[i, column[previous]] >= scores[i, j] - STICKINESS:
+                j = column[previous]
+            if scores[i, j] >= min_correlation:
+                shift = lags[j]
+        matched.append(shift)
+        flat.append(is_flat)
+        if not is_flat:
+            previous = shift
+
+    # Drop isolated matches (flat blocks in between neither extend nor break a run)
+    structured = [i for i in range(len(spans)) if not flat[i]]
+    i = 0
+    while i < len(structured):
+        j = i
+        while j < len(structured) and matched[structured[j]] == matched[structured[i]]:
+            j += 1
+        if j - i < MIN_RUN:
+            for k in structured[i:j]:
+                matched[k] = None
+        i = j
+
+    # Flat blocks: the same flat audio at a neighbour's shift
+    def same_flat(index, shift):
+        start, stop = spans[index]
+        if start - shift < 0 or stop - shift > len(old):
+            return False
+        y = old[start - shift:stop - shift]
+        return float(y.std()) < MIN_SPREAD and abs(float(y.mean()) - float(new[start:stop].mean())) < 0.1
+
+    for order in (range(len(spans)), range(len(spans) - 1, -1, -1)):
+        neighbour = None
+        for index in order:
+            if flat[index] and matched[index] is None and neighbour is not None and same_flat(index, neighbour):
+                matched[index] = neighbour
+            neighbour = matched[index]
+    return [(start, stop, shift) for (start, stop), shift in zip(spans, matched)]
+
+def _refine(new_bands, old_bands, start, stop, shift):
+    """Sub-frame shift (frames) of a matched run, by parabolic interpolation of band-energy correlation."""
+    np = lazy_import("numpy")
+    scores = []
+    for lag in (-1, 0, 1):
+        a, b = start - shift - lag, stop - shift - lag
+        if a < 0 or b > len(old_bands):
+            return float(shift)
+        x, y = new_bands[start:stop].ravel(), old_bands[a:b].ravel()
+        scores.append(float(np.dot(x - x.mean(), y - y.mean())))
+    left, centre, right = scores
+    curvature = left - 2 * centre + right
+    offset = 0.5 * (left - right) / curvature if curvature < 0 else 0.0
+    return shift + float(np.clip(offset, -0.5, 0.5))
+
+def plan(new_bands, old_bands, frame_seconds, duration, matches=None):
+    """Splits the new timeline into [(start_s, end_s, shift_s or None), ...]: reused or to transcribe.
+
+    matches: align()'s result, if already computed.
+    """
+    matches = align(new_bands, old_bands, frame_seconds) if matches is None else matches
+    runs = []
+    for start, stop, shift in matches:
+        if runs and runs[-1][2] == shift:
+            runs[-1][1] = stop
+        else:
+            runs.append([start, stop, shift])
+    regions = []
+    for start, stop, shift in runs:
+        t0 = start * frame_seconds
+        t1 = duration if stop == len(new_bands) else stop * frame_seconds
+        if shift is not None:
+            shift = _refine(new_bands, old_bands, start, stop, shift) * frame_seconds
+        regions.append((t0, t1, shift))
+    return regions
+
+
+# --- SPLICING ---
+
+def _take(events, t0, t1, shift):
+    """Events starting in [t0, t1) of the source timeline, moved by shift."""
+    return [(s + shift, e + shift) + tuple(rest) for s, e, *rest in events if t0 <= s < t1]
+
+def _splice_midi(pieces):
+    """One MIDI from [(midi_bytes, t0, t1, shift), ...]: notes (and pitch bends) in [t0, t1) moved by shift."""
+    pretty_midi = lazy_import("pretty_midi")
+    out = pretty_midi.PrettyMIDI()
+    instrument = None
+    for midi_bytes, t0, t1, shift in pieces:
+        pm = pretty_midi.PrettyMIDI(io.BytesIO(midi_bytes))
+        for source in pm.instruments:
+            if instrument is None:
+                instrument = pretty_midi.Instrument(source.program, source.is_drum, source.name)
+            for note in source.notes:
+                if t0 <= note.start < t1:
+                    instrument.notes.append(pretty_midi.Note(note.velocity, note.pitch,
+                                                             note.start + shift, note.end + shift))
+            for bend in source.pitch_bends:
+                if t0 <= bend.time < t1:
+                    instrument.pitch_bends.append(pretty_midi.PitchBend(bend.pitch, bend.time + shift))
+    if instrument is not None:
+        instrument.notes.sort(key=lambda n: n.start)
+        instrument.pitch_bends.sort(key=lambda b: b.time)
+        out.instruments.append(instrument)
+    buffer = io.BytesIO()
+    out.write(buffer)
+    return buffer.getvalue()
+
+
+# --- ANALYSIS ---
+
+def transcribe_incremental(audio, sr, new_bands, frame_seconds, previous, transcribe,
+                           context_seconds=CONTEXT_SECONDS, matches=None):
+    """Note events and MIDI for audio, reusing previous = (bands, events, midi_bytes) where it matches.
+
+    transcribe(pcm) -> (events, midi_bytes). Returns (events, midi_bytes, report).
+    """
+    duration = len(audio) / sr
+    old_bands, old_events, old_midi = previous
+    regions = plan(new_bands, old_bands, frame_seconds, duration, matches)
+    events, pieces = [], []
+    reused = transcribed = 0.0
+    for t0, t1, shift in regions:
+        if shift is not None:
+            events += _take(old_events, t0 - shift, t1 - shift, shift)
+            pieces.append((old_midi, t0 - shift, t1 - shift, shift))
+            reused += t1 - t0
+            continue
+        a, b = max(t0 - context_seconds, 0.0), min(t1 + context_seconds, duration)
+        region_events, region_midi = transcribe(audio[int(a * sr):int(b * sr)])
+        # Keep what starts inside the region; the context only gives edge notes their onset
+        events += _take(region_events, t0 - a, t1 - a, a)
+        pieces.append((region_midi, t0 - a, t1 - a, a))
+        transcribed += b - a
+    events.sort()
+    report = {
+        "reused_s": round(reused, 2),
+        "transcribed_s": round(transcribed, 2),
+        "duration_s": round(duration, 2),
+        "regions": [(round(t0, 2), round(t1, 2), None if s is None else round(s, 3)) for t0, t1, s in regions],
+    }
+    return events, _splice_midi(pieces), report
+
+def engine_transcriber(whole, spectrogram=None, skip_silence=True, activity=None):
+    """transcribe(pcm) for analyze(): engine.transcribe_audio, on the active parts only with skip_silence.
+
+    spectrogram (the magnitude STFT of whole) is used when all of whole is
+    transcribed; activity, a dict, then receives the activity summary.
+    """
+    engine = lazy_import("engine")
+
+    def transcribe(pcm):
+        if not skip_silence:
+            return engine.transcribe_audio(pcm)
+        # The stored STFT only lines up with the whole audio, not with a changed region
+        events, midi_bytes, timeline = lazy_import("activity").transcribe_active(
+            pcm, spectrogram if pcm is whole else None
+        )
+        if pcm is whole and activity is not None:
+            activity.update(timeline.summary())
+        return events, midi_bytes
+    return transcribe
+
+def analyze(store, audio_key, audio, sr, mel, hop_length, transcribe, variant="default"):
+    """transcribe(audio), reusing the best-matching earlier analysis of the same variant in store.
+
+    Results are remembered for later uploads. Returns (events, midi_bytes, report);
+    report is None when everything was transcribed from scratch.
+    """
+    np = lazy_import("numpy")
+    frame_seconds = hop_length / sr
+    bands = band_energies(mel)
+    # The same audio analyzed before is a candidate too (it matches everywhere)
+    history = list(store.get(OWNER, f"{variant}_history", []))
+
+    best = None
+    for key in history:
+        previous = [store.get(OWNER, f"{variant}_{key}_{part}") for part in ("bands", "events", "midi")]
+        if any(part is None for part in previous):
+            continue
+        # Unrelated audio is ruled out by one coarse whole-track correlation
+        similarity, shifts = candidate_shifts(bands, previous[0])
+        if similarity < MIN_SIMILARITY:
+            continue
+        # Keep the earlier analysis that covers the most of the new audio
+        matches = align(bands, previous[0], frame_seconds, shifts=shifts)
+        matched = sum(stop - start for start, stop, shift in matches if shift is not None)
+        if matched and (best is None or matched > best[0]):
+            best = (matched, previous, matches)
+
+    report = None
+    if best is not None:
+        old_bands, old_events, old_midi = best[1]
+        old_events = [(s, e, int(p), a) for s, e, p, a in old_events.tolist()]
+        events, midi_bytes, report = transcribe_incremental(
+            audio, sr, bands, frame_seconds, (old_bands, old_events, old_midi), transcribe, matches=best[2],
+        )
+    else:
+        events, midi_bytes = transcribe(audio)
+
+    store.put(OWNER, f"{variant}_{audio_key}_bands", bands)
+    store.put(OWNER, f"{variant}_{audio_key}_events", np.asarray(events, dtype=np.float64).reshape(-1, 4))
+    store.put(OWNER, f"{variant}_{audio_key}_midi", midi_bytes)
+    store.put(OWNER, f"{variant}_history", ([audio_key] + [key for key in history if key != audio_key])[:HISTORY])
+    return events, midi_bytes, report
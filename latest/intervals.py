@@ -0,0 +1,152 @@
+"""Sorted-array interval index for chord segments and note events.
+
+"What is sounding at t", "which notes fall in this window" and "which chord does
+each note belong to" are binary searches over start-sorted arrays instead of
+scans over Python lists, so they stay cheap on long pieces and can run on every
+Playback Guide refresh.
+
+Overlap queries bound their scan with a running maximum of the interval ends.
+A single long interval (a held pedal note) would keep that maximum high for
+everything after it, so intervals are grouped by length: the typical ones
+together, longer ones in classes whose lengths are within a factor of two. In
+each group the scan only covers intervals that start less than the group's
+longest length before the query, so it stays close to the number of hits.
+Sparse long classes share one small list that is checked in full.
+"""
+import sys
+
+import numpy as np
+
+# Intervals longer than this many times the median length go into the long classes
+LONG_FACTOR = 4.0
+# Long classes with fewer intervals than this go into the list checked on every query
+MIN_GROUP = 512
+
+
+class IntervalIndex:
+    """Intervals [start, end) sorted by start, with optional labels (e.g. chord names).
+
+    Query results are indices into the sorted order; `order` maps them back to
+    the order the intervals were given in.
+    """
+
+    def __init__(self, start, end, labels=None):
+        start = np.asarray(start, dtype=np.float64).reshape(-1)
+        self.order = np.argsort(start, kind="stable")
+        self.start = start[self.order]
+        self.end = np.asarray(end, dtype=np.float64).reshape(-1)[self.order]
+        self.labels = None if labels is None else np.asarray(labels, dtype=object)[self.order]
+        self._groups = self._length_groups()
+
+    def _length_groups(self):
+        """([(positions, starts, ends, running max of ends), ...] per length class, sparse list).
+
+        Within a group, every interval before the first position where the running
+        maximum exceeds t ends at or before t, which bounds overlap queries from the left.
+        The sparse list (positions, starts, ends) holds the long classes below MIN_GROUP.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if not len(self.start):
+            return [], (empty, self.start, self.end)
+        lengths = np.maximum(self.end - self.start, 0.0)
+        cutoff = LONG_FACTOR * float(np.median(lengths))
+        if cutoff > 0:
+            long_class = np.floor(np.log2(np.maximum(lengths, cutoff) / cutoff)).astype(np.int64) + 1
+            group_ids = np.where(lengths > cutoff, long_class, 0)
+        else:
+            group_ids = np.zeros(len(lengths), dtype=np.int64)
+        groups, sparse = [], [empty]
+        for group_id in np.unique(group_ids):
+            positions = np.flatnonzero(group_ids == group_id)
+            if group_id and len(positions) < MIN_GROUP:
+                sparse.append(positions)
+                continue
+            ends = self.end[positions]
+            groups.append((positions, self.start[positions], ends, np.maximum.accumulate(ends)))
+        sparse = np.sort(np.concatenate(sparse))
+        return groups, (sparse, self.start[sparse], self.end[sparse])
+
+    def _stab(self, t0, t1, side):
+        """Indices of intervals with start < t1 (<= t1 for side="right") and end > t0, in start order."""
+        groups, (positions, starts, ends) = self._groups
+        found = []
+        for group_positions, group_starts, group_ends, max_end in groups:
+            hi = int(group_starts.searchsorted(t1, side=side))
+            lo = int(max_end.searchsorted(t0, side="right"))
+            if lo < hi:
+                found.append(group_positions[lo + (group_ends[lo:hi] > t0).nonzero()[0]])
+        if len(positions):
+            begun = starts <= t1 if side == "right" else starts < t1
+            hits = positions[begun & (ends > t0)]
+            if len(hits):
+                found.append(hits)
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return found[0] if len(found) == 1 else np.sort(np.concatenate(found))
+
+    @classmethod
+    def from_segments(cls, segments):
+        """From [(start, end, label), ...] such as chords.extract_chords output."""
+        segments = list(segments)
+        return cls([s[0] for s in segments], [s[1] for s in segments], [s[2] for s in segments])
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def nbytes(self):
+        """Memory held by the index: its arrays, the length groups and the label objects."""
+        groups, sparse = self._groups
+        total = self.start.nbytes + self.end.nbytes + self.order.nbytes
+        total += sum(array.nbytes for group in groups for array in group) + sum(array.nbytes for array in sparse)
+        if self.labels is not None:
+            total += self.labels.nbytes + sum(sys.getsizeof(label) for label in self.labels)
+        return total
+
+    def label(self, i):
+        return None if self.labels is None or i < 0 else self.labels[i]
+
+    def starting(self, t0, t1):
+        """Index range [lo, hi) of intervals starting in [t0, t1)."""
+        lo = int(np.searchsorted(self.start, t0, side="left"))
+        hi = int(np.searchsorted(self.start, t1, side="left"))
+        return lo, hi
+
+    def overlapping(self, t0, t1):
+        """Indices of intervals that overlap [t0, t1) (start < t1 and end > t0), in start order."""
+        return self._stab(t0, t1, "left")
+
+    def at(self, t):
+        """Indices of intervals sounding at time t (start <= t < end)."""
+        return self._stab(t, t, "right")
+
+    def within(self, t0, t1):
+        """Indices of intervals entirely inside [t0, t1]."""
+        lo = int(np.searchsorted(self.start, t0, side="left"))
+        hi = int(np.searchsorted(self.start, t1, side="right"))
+        return lo + np.flatnonzero(self.end[lo:hi] <= t1)
+
+    def enclosing(self, times):
+        """For each time, the index of the latest-starting interval containing it, or -1.
+
+        Vectorized over times. Exact for non-overlapping segments such as chords,
+        which is what the note-to-chord join relies on.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        idx = np.searchsorted(self.start, times, side="right") - 1
+        inside = (idx >= 0) & (self.end[np.maximum(idx, 0)] > times) if len(self) else np.zeros(times.shape, bool)
+        return np.where(inside, idx, -1)
+
+    def labels_at(self, times, missing=""):
+        """Label of the enclosing interval for each time (missing where there is none)."""
+        idx = self.enclosing(times)
+        if self.labels is None or not len(self):
+            return np.full(idx.shape, missing, dtype=object)
+        return np.where(idx >= 0, self.labels[np.maximum(idx, 0)], missing)
+
+    def group(self, times):
+        """Indices into times grouped by enclosing interval: {interval index: array of time indices}."""
+        idx = self.enclosing(times)
+        order = np.argsort(idx, kind="stable")
+        keys, first = np.unique(idx[order], return_index=True)
+        return {int(k): g for k, g in zip(keys, np.split(order, first[1:])) if k >= 0}
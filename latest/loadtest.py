@@ -0,0 +1,433 @@
+"""Load test for the Streamlit UI: N concurrent simulated sessions against a local instance.
+
+    python latest/loadtest.py --sessions 8 --seconds 60
+
+Starts app-latest.py on a free port (or uses --url for one already running with
+--server.enableXsrfProtection=false) and drives every session the way a
+browser does, over the websocket and upload endpoints, with no browser:
+
+    connect      websocket + first script run (page render)
+    upload       PUT of a synthetic WAV to the upload endpoint
+    spectrogram  rerun with the file attached (decode + mel spectrogram)
+    analyze      "Analyze Instrument" click until the script run finishes
+    download     "Download Everything": deferred bundle build + GET of the zip
+
+Each session gets its own synthetic track (chords over a bass line, with
+silence), unless --same-audio makes them share one to exercise the caches.
+Tracks are new on every run (--seed repeats a run's audio), and a server
+started here gets empty feature and artifact directories, so decoding,
+spectrograms and inference are measured cold; the report says when they may
+not have been. Reports p50/p95/p99 per step, completed sessions per minute
+and the peak RSS of the server process (Linux), to size hosts from.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from startup import lazy_import
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app-latest.py")
+STEPS = ("connect", "upload", "spectrogram", "analyze", "download")
+ANALYZE_LABEL = "🚀 Analyze Instrument"
+BUNDLE_LABEL = "📦 Download Everything"
+SEPARATE_PREFIX = "🎤 Separate vocals"
+
+
+# --- SYNTHETIC AUDIO ---
+
+def synthetic_wav(seconds, seed=0, sr=22050):
+    """16-bit WAV bytes: a I-V-vi-IV progression with a bass line, a little noise and a silent gap."""
+    np = lazy_import("numpy")
+    sf = lazy_import("soundfile")
+    rng = np.random.default_rng(seed)
+    root = 48 + int(rng.integers(0, 12))
+    progression = [(0, 4, 7), (7, 11, 14), (9, 12, 16), (5, 9, 12)]
+    beat = 60 / float(rng.uniform(80, 140))
+    t = np.arange(int(4 * beat * sr)) / sr
+    envelope = np.exp(-t * 1.5)
+    bars = []
+    for i in range(int(np.ceil(seconds / (4 * beat)))):
+        chord = progression[i % 4]
+        freqs = [440 * 2 ** ((root + 12 + interval - 69) / 12) for interval in chord]
+        freqs.append(440 * 2 ** ((root - 12 + chord[0] - 69) / 12))
+        bars.append(envelope * sum(np.sin(2 * np.pi * f * t) for f in freqs) / len(freqs))
+    y = np.concatenate(bars)[:int(seconds * sr)]
+    y += 0.005 * rng.standard_normal(len(y))
+    gap = slice(int(0.45 * len(y)), int(0.5 * len(y)))
+    y[gap] = 0.0  # a break, as real recordings have
+    buffer = io.BytesIO()
+    sf.write(buffer, (0.5 * y).astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+# --- HEADLESS CLIENT ---
+
+class StepFailed(Exception):
+    pass
+
+
+class Session:
+    """One simulated browser tab speaking the Streamlit websocket protocol."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.ws = None
+        self.session_id = None
+        self.widgets = {}       # persistent widget states by id
+        self.elements = {}      # latest widget protos by label
+        self.uploader = None
+        self.alerts = []
+        self.exceptions = []
+
+    async def connect(self):
+        websocket = lazy_import("tornado.websocket")
+        url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.ws = await asyncio.wait_for(websocket.websocket_connect(url), self.timeout)
+        await self.rerun()
+
+    async def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def _send(self, back_msg):
+        await self.ws.write_message(back_msg.SerializeToString(), binary=True)
+
+    async def _receive(self, until):
+        """Reads forward messages, recording widgets and alerts, until until(msg) is true."""
+        forward = lazy_import("streamlit.proto.ForwardMsg_pb2")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise StepFailed(f"no reply within {self.timeout:.0f}s")
+            payload = await asyncio.wait_for(self.ws.read_message(), remaining)
+            if payload is None:
+                raise StepFailed("server closed the connection")
+            msg = forward.ForwardMsg()
+            msg.ParseFromString(payload)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = msg.new_session.initialize.session_id
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._record(msg.delta.new_element)
+            if until(msg):
+                return msg
+
+    def _record(self, element):
+        kind = element.WhichOneof("type")
+        if kind == "file_uploader":
+            self.uploader = element.file_uploader
+        elif kind in ("button", "download_button", "checkbox"):
+            widget = getattr(element, kind)
+            self.elements[widget.label] = widget
+        elif kind == "alert":
+            self.alerts.append((element.alert.format, element.alert.body))
+        elif kind == "exception":
+            self.exceptions.append(element.exception.message)
+
+    async def rerun(self, triggers=()):
+        """Reruns the script with the persistent widget states (plus one-shot button triggers)."""
+        back = lazy_import("streamlit.proto.BackMsg_pb2")
+        msg = back.BackMsg()
+        msg.rerun_script.SetInParent()  # an empty rerun is still a rerun
+        for state in self.widgets.values():
+            msg.rerun_script.widget_states.widgets.add().CopyFrom(state)
+        for widget_id in triggers:
+            trigger = msg.rerun_script.widget_states.widgets.add()
+            trigger.id = widget_id
+            trigger.trigger_value = True
+        self.alerts, self.exceptions = [], []
+        await self._send(msg)
+        await self._receive(lambda m: m.WhichOneof("type") == "script_finished")
+        if self.exceptions:
+            raise StepFailed(self.exceptions[0])
+        errors = [body for fmt, body in self.alerts if fmt == 1]  # Alert.ERROR
+        if errors:
+            raise StepFailed(errors[0])
+
+    def _widget(self, label, prefix=False):
+        for name, widget in self.elements.items():
+            if name == label or (prefix and name.startswith(label)):
+                return widget
+        raise StepFailed(f"the page has no {label!r} widget")
+
+    async def upload(self, name, data):
+        back = lazy_import("streamlit.proto.BackMsg_pb2")
+        common = lazy_import("streamlit.proto.Common_pb2")
+        httpclient = lazy_import("tornado.httpclient")
+        if self.uploader is None:
+            raise StepFailed("the page has no file uploader")
+
+        request_id = uuid.uuid4().hex
+        msg = back.BackMsg()
+        msg.file_urls_request.request_id = request_id
+        msg.file_urls_request.file_names.append(name)
+        msg.file_urls_request.session_id = self.session_id
+        await self._send(msg)
+        reply = await self._receive(lambda m: m.WhichOneof("type") == "file_urls_response"
+                                    and m.file_urls_response.response_id == request_id)
+        if reply.file_urls_response.error_msg:
+            raise StepFailed(reply.file_urls_response.error_msg)
+        urls = reply.file_urls_response.file_urls[0]
+
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+                f"Content-Type: audio/wav\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+        await httpclient.AsyncHTTPClient().fetch(
+            self.base_url + urls.upload_url, method="PUT", body=body, request_timeout=self.timeout,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+        state = common.FileUploaderState()
+        info = state.uploaded_file_info.add()
+        info.file_id, info.name, info.size = urls.file_id, name, len(data)
+        info.file_urls.CopyFrom(urls)
+        widget_id = self.uploader.id
+        self.widgets.setdefault(widget_id, _widget_state(widget_id)).file_uploader_state_value.CopyFrom(state)
+
+    def check(self, label, value=True):
+        widget_id = self._widget(label, prefix=True).id
+        self.widgets.setdefault(widget_id, _widget_state(widget_id)).bool_value = value
+
+    async def click(self, label):
+        await self.rerun(triggers=[self._widget(label, prefix=True).id])
+
+    async def download(self, label):
+        """Bytes behind a download button (asks the server to build deferred files first)."""
+        back = lazy_import("streamlit.proto.BackMsg_pb2")
+        httpclient = lazy_import("tornado.httpclient")
+        button = self._widget(label, prefix=True)
+        url = button.url
+        if button.deferred_file_id:
+            msg = back.BackMsg()
+            msg.deferred_file_request.file_id = button.deferred_file_id
+            msg.deferred_file_request.session_id = self.session_id
+            await self._send(msg)
+            reply = await self._receive(lambda m: m.WhichOneof("type") == "deferred_file_response"
+                                        and m.deferred_file_response.file_id == button.deferred_file_id)
+            if reply.deferred_file_response.error_msg:
+                raise StepFailed(reply.deferred_file_response.error_msg)
+            url = reply.deferred_file_response.url
+        response = await httpclient.AsyncHTTPClient().fetch(
+            url if url.startswith("http") else self.base_url + url, request_timeout=self.timeout
+        )
+        return response.body
+
+def _widget_state(widget_id):
+    state = lazy_import("streamlit.proto.WidgetStates_pb2").WidgetState()
+    state.id = widget_id
+    return state
+
+
+# --- RUN ---
+
+async def simulate(index, base_url, audio, options, results):
+    """One session through every step; appends (step, seconds, error) to results."""
+    session = Session(base_url, options.timeout)
+    try:
+        for step in STEPS:
+            started = time.perf_counter()
+            try:
+                if step == "connect":
+                    await session.connect()
+                elif step == "upload":
+                    await session.upload(f"loadtest_{index}.wav", audio)
+                elif step == "spectrogram":
+                    await session.rerun()
+                    if options.separate:
+                        session.check(SEPARATE_PREFIX)
+                elif step == "analyze":
+                    await session.click(ANALYZE_LABEL)
+                    if not any(fmt == 4 for fmt, _ in session.alerts):  # Alert.SUCCESS
+                        raise StepFailed("analysis did not report success")
+                elif step == "download":
+                    if not await session.download(BUNDLE_LABEL):
+                        raise StepFailed("empty download")
+            except Exception as e:
+                results.append((step, time.perf_counter() - started, f"{type(e).__name__}: {e}"))
+                return False
+            results.append((step, time.perf_counter() - started, None))
+        return True
+    finally:
+        await session.close()
+
+async def run_load(base_url, options, server_pid=None):
+    sessions = options.sessions
+    # Seeds are salted per run: identical audio would hit the feature and incremental caches
+    shared = synthetic_wav(options.seconds, seed=options.seed) if options.same_audio else None
+    tracks = [shared or synthetic_wav(options.seconds, seed=options.seed + i) for i in range(sessions)]
+    results, peak = [], {"rss": 0}
+
+    async def sample_memory():
+        while True:
+            peak["rss"] = max(peak["rss"], _rss(server_pid, "VmRSS"))
+            await asyncio.sleep(0.25)
+
+    sampler = asyncio.ensure_future(sample_memory()) if server_pid else None
+    started = time.perf_counter()
+
+    async def delayed(i):
+        await asyncio.sleep(i * options.ramp / max(sessions, 1))
+        return await simulate(i, base_url, tracks[i], options, results)
+
+    completed = await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+    return results, sum(completed), elapsed, peak["rss"]
+
+def _rss(pid, field):
+    """Resident memory (bytes) of a process from /proc: VmRSS now, VmHWM the peak so far."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+def cache_state(options, fresh_server):
+    """How warm the server's caches were for this run, for the report."""
+    if fresh_server and not options.seed_given:
+        state = "cold (new server with empty feature/artifact directories, new audio)"
+    elif fresh_server:
+        state = "cold (new server with empty feature/artifact directories)"
+    elif options.seed_given:
+        state = "possibly warm: --seed repeats audio an earlier run may have sent to this server"
+    else:
+        state = "cold for this audio (new audio; the running server's other state is not reset)"
+    if options.same_audio and options.sessions > 1:
+        state += "; sessions share one track, so all but the first hit warm caches"
+    return state
+
+def summarize(results, completed, sessions, elapsed, peak_rss, caches=None):
+    np = lazy_import("numpy")
+    steps = {}
+    for step in STEPS:
+        rows = [r for r in results if r[0] == step]
+        ok = [seconds for _, seconds, error in rows if error is None]
+        errors = sorted({error for _, _, error in rows if error is not None})
+        steps[step] = {
+            "runs": len(rows),
+            "ok": len(ok),
+            "p50_s": round(float(np.percentile(ok, 50)), 3) if ok else None,
+            "p95_s": round(float(np.percentile(ok, 95)), 3) if ok else None,
+            "p99_s": round(float(np.percentile(ok, 99)), 3) if ok else None,
+            "max_s": round(max(ok), 3) if ok else None,
+            "errors": errors[:3],
+        }
+    return {
+        "sessions": sessions,
+        "completed": completed,
+        "wall_s": round(elapsed, 2),
+        "sessions_per_minute": round(60 * completed / elapsed, 2) if elapsed else None,
+        "server_peak_rss_mb": round(peak_rss / 2**20, 1) if peak_rss else None,
+        "caches": caches,
+        "steps": steps,
+    }
+
+def print_report(report):
+    print(f"{report['completed']}/{report['sessions']} sessions completed in {report['wall_s']}s "
+          f"({report['sessions_per_minute']} sessions/min)")
+    if report["server_peak_rss_mb"]:
+        print(f"server peak RSS: {report['server_peak_rss_mb']} MB")
+    if report.get("caches"):
+        print(f"caches: {report['caches']}")
+    if report.get("seed") is not None:
+        print(f"audio seed: {report['seed']} (--seed repeats it)")
+    print(f"{'step':<12} {'ok':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for step, row in report["steps"].items():
+        cells = [f"{row[k]:.2f}s" if row[k] is not None else "-" for k in ("p50_s", "p95_s", "p99_s", "max_s")]
+        print(f"{step:<12} {row['ok']:>3}/{row['runs']:<3} " + " ".join(f"{c:>8}" for c in cells))
+        for error in row["errors"]:
+            print(f"    ! {error}")
+
+
+# --- LOCAL SERVER ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port, state_dir, startup_timeout=120):
+    """app-latest.py in a headless Streamlit process with its features and artifacts
+    under state_dir (so nothing from earlier runs is reused); returns (process, base_url)."""
+    env = dict(os.environ,
+               CHORDIA_FEATURE_DIR=os.path.join(state_dir, "features"),
+               CHORDIA_ARTIFACT_DIR=os.path.join(state_dir, "artifacts"))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless=true",
+         f"--server.port={port}", "--server.address=127.0.0.1", "--server.enableXsrfProtection=false",
+         "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process, base_url
+        except OSError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("streamlit did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Chordia UI")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated sessions")
+    parser.add_argument("--seconds", type=float, default=30.0, help="length of the synthetic audio")
+    parser.add_argument("--ramp", type=float, default=0.0, help="spread session starts over this many seconds")
+    parser.add_argument("--timeout", type=float, default=600.0, help="per-step timeout (s)")
+    parser.add_argument("--same-audio", action="store_true", help="all sessions upload the same track")
+    parser.add_argument("--separate", action="store_true", help="tick source separation before analyzing")
+    parser.add_argument("--seed", type=int, help="audio seed (default: new audio every run)")
+    parser.add_argument("--url", help="use a running instance instead of starting one")
+    parser.add_argument("--json", help="also write the report to this file")
+    options = parser.parse_args()
+    options.seed_given = options.seed is not None
+    if not options.seed_given:
+        options.seed = random.randrange(2**31)
+
+    process = state_dir = None
+    if options.url:
+        base_url, pid = options.url, None
+    else:
+        state_dir = tempfile.mkdtemp(prefix="chordia_loadtest_")
+        process, base_url = start_server(_free_port(), state_dir)
+        pid = process.pid
+    try:
+        results, completed, elapsed, peak_rss = asyncio.run(run_load(base_url, options, pid))
+        if pid:
+            peak_rss = max(peak_rss, _rss(pid, "VmHWM"))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if state_dir:
+            shutil.rmtree(state_dir, ignore_errors=True)
+    report = summarize(results, completed, options.sessions, elapsed, peak_rss,
+                       cache_state(options, process is not None))
+    report["seed"] = options.seed
+    print_report(report)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
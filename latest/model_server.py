@@ -0,0 +1,262 @@
+"""Long-lived local inference daemon that keeps the models warm for every UI replica on a host.
+
+    python latest/model_server.py --socket /run/chordia/model.sock [--piano]
+
+Streamlit replicas (and api.py) use it when CHORDIA_MODEL_SOCKET points at the
+socket. They send mono PCM and get note events + MIDI back, so TensorFlow /
+Basic Pitch (and the PyTorch piano model) are loaded once per host instead of
+once per process, and UI replicas can be scaled independently.
+
+Wire format (Unix stream socket, persistent connections): every message is
+`!II` (header length, payload length), a JSON header, then the raw bytes of the
+arrays listed in header["arrays"] back to back.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import engine
+from startup import lazy_import, resource
+
+PREFIX = struct.Struct("!II")
+PIANO_SAMPLE_RATE = 16000  # piano_transcription_inference.sample_rate
+
+
+# --- WIRE FORMAT ---
+
+def send_message(sock, header, arrays=()):
+    specs = []
+    buffers = []
+    for name, array in arrays:
+        array = np.ascontiguousarray(array)
+        specs.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape)})
+        buffers.append(memoryview(array).cast("B"))
+    head = json.dumps(dict(header, arrays=specs)).encode("utf-8")
+    sock.sendall(PREFIX.pack(len(head), sum(len(b) for b in buffers)) + head)
+    for buffer in buffers:
+        sock.sendall(buffer)
+
+def recv_message(sock):
+    """Returns (header, {name: array}) or None when the peer closed the connection."""
+    prefix = _recv_exact(sock, PREFIX.size)
+    if prefix is None:
+        return None
+    head_len, payload_len = PREFIX.unpack(prefix)
+    head = _recv_exact(sock, head_len)
+    payload = _recv_exact(sock, payload_len) if payload_len else bytearray()
+    if head is None or payload is None:
+        raise ConnectionError("model server connection closed mid-message")
+    header = json.loads(head)
+    arrays = {}
+    offset = 0
+    for spec in header.pop("arrays", []):
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[spec["name"]] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(spec["shape"])
+        offset += count * dtype.itemsize
+    return header, arrays
+
+def _recv_exact(sock, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError("model server connection closed mid-message")
+        received += count
+    return buffer
+
+
+# --- SERVER ---
+
+def load_piano_model():
+    torch = lazy_import("torch")
+    piano = lazy_import("piano_transcription_inference")
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return piano.PianoTranscription(device=device)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, ModelRequestHandler)
+        os.chmod(socket_path, 0o660)
+        # Basic Pitch windows from all clients go through the shared micro-batcher;
+        # the piano model segments audio internally, so its calls are just serialized
+        self.piano_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"started": time.time(), "requests": 0, "errors": 0, "busy_seconds": 0.0}
+
+    def dispatch(self, header, arrays):
+        op = header.get("op")
+        if op == "ping":
+            return {"ok": True}, []
+        if op == "stats":
+            with self.stats_lock:
+                stats = dict(self.stats)
+            stats["batching"] = engine.get_batcher().metrics()
+            return {"ok": True, "stats": stats}, []
+
+        started = time.perf_counter()
+        if op == "predict":
+            outputs = engine.local_predictor()(arrays["windows"])
+            reply = {"ok": True}, list(outputs.items())
+        elif op == "transcribe":
+            note_events, midi_bytes = engine.transcribe_pcm(
+                arrays["audio"], predict=engine.local_predictor(), **header.get("options", {})
+            )
+            reply = (
+                {"ok": True},
+                [("note_events", np.asarray(note_events, dtype=np.float64).reshape(-1, 4)),
+                 ("midi", np.frombuffer(midi_bytes, dtype=np.uint8))],
+            )
+        elif op == "piano":
+            with self.piano_lock:
+                note_events, midi_bytes = self.transcribe_piano(arrays["audio"])
+            reply = {"ok": True, "note_events": note_events}, [("midi", np.frombuffer(midi_bytes, dtype=np.uint8))]
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["busy_seconds"] += time.perf_counter() - started
+        return reply
+
+    def transcribe_piano(self, audio):
+        transcriptor = resource("piano_model", load_piano_model)
+        fd, midi_path = tempfile.mkstemp(prefix="chordia_piano_", suffix=".mid")
+        os.close(fd)
+        try:
+            result = transcriptor.transcribe(np.asarray(audio, dtype=np.float32), midi_path)
+            with open(midi_path, "rb") as f:
+                midi_bytes = f.read()
+        finally:
+            os.remove(midi_path)
+        note_events = [
+            (float(n["onset_time"]), float(n["offset_time"]), int(n["midi_note"]), float(n["velocity"]) / 127)
+            for n in result["est_note_events"]
+        ]
+        return note_events, midi_bytes
+
+
+class ModelRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            try:
+                reply_header, reply_arrays = self.server.dispatch(*message)
+            except Exception as e:
+                with self.server.stats_lock:
+                    self.server.stats["errors"] += 1
+                reply_header, reply_arrays = {"ok": False, "error": str(e)}, []
+            send_message(self.request, reply_header, reply_arrays)
+
+
+# --- CLIENT ---
+
+class ModelClient:
+    """Thread-safe client; keeps one persistent connection per calling thread."""
+
+    def __init__(self, socket_path, timeout=600):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self.local.sock = None
+
+    def call(self, header, arrays=()):
+        # Requests are idempotent, so a stale connection (server restarted) is retried once
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_message(sock, header, arrays)
+                reply = recv_message(sock)
+                if reply is None:
+                    raise ConnectionError("model server closed the connection")
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        reply_header, reply_arrays = reply
+        if not reply_header.get("ok"):
+            raise RuntimeError(f"model server: {reply_header.get('error')}")
+        return reply_header, reply_arrays
+
+    def ping(self):
+        self.call({"op": "ping"})
+        return True
+
+    def stats(self):
+        return self.call({"op": "stats"})[0]["stats"]
+
+    def predict(self, windows):
+        return self.call({"op": "predict"}, [("windows", np.asarray(windows, dtype=np.float32))])[1]
+
+    def transcribe(self, audio, **options):
+        """Same contract as engine.transcribe_pcm: (note_events, midi_bytes)."""
+        _, arrays = self.call(
+            {"op": "transcribe", "options": options},
+            [("audio", np.asarray(audio, dtype=np.float32))],
+        )
+        note_events = [(float(s), float(e), int(p), float(a)) for s, e, p, a in arrays["note_events"]]
+        return note_events, arrays["midi"].tobytes()
+
+    def transcribe_piano(self, audio):
+        """PianoTranscription on mono PIANO_SAMPLE_RATE audio -> ([(start, end, pitch, amplitude), ...], midi_bytes)."""
+        header, arrays = self.call({"op": "piano"}, [("audio", np.asarray(audio, dtype=np.float32))])
+        return [tuple(n) for n in header["note_events"]], arrays["midi"].tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chordia model server")
+    parser.add_argument("--socket", default=os.environ.get("CHORDIA_MODEL_SOCKET", "/run/chordia/model.sock"))
+    parser.add_argument("--piano", action="store_true", help="also keep the PyTorch piano model warm")
+    args = parser.parse_args()
+
+    engine.get_model()
+    engine.get_batcher()
+    if args.piano:
+        resource("piano_model", load_piano_model)
+    server = ModelServer(args.socket)
+    print(f"Chordia model server listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compact columnar storage for transcribed notes.
+
+A dense transcription can have tens of thousands of notes. Keeping them as a
+list of dicts and rebuilding a DataFrame on every rerun makes the Playback Guide
+cost grow with track length. NoteTable keeps one numpy array per column, sorted
+by start time, and only materializes the rows that are actually displayed.
+"""
+import numpy as np
+
+from intervals import IntervalIndex
+from notes import get_note_name
+
+NOTE_NAMES = np.array([get_note_name(p) for p in range(128)])
+
+
+class NoteTable:
+    def __init__(self, start, end, pitch, velocity):
+        order = np.argsort(start, kind="stable")
+        self.start = np.asarray(start, dtype=np.float32)[order]
+        self.end = np.asarray(end, dtype=np.float32)[order]
+        self.pitch = np.asarray(pitch, dtype=np.uint8)[order]
+        self.velocity = np.asarray(velocity, dtype=np.uint8)[order]
+        self._index = None
+
+    @classmethod
+    def from_events(cls, note_events):
+        """From [(start_s, end_s, pitch_midi, amplitude), ...] as produced by engine.transcribe_*."""
+        events = np.asarray(note_events, dtype=np.float64).reshape(-1, 4)
+        velocity = np.clip(np.round(events[:, 3] * 127), 0, 127)
+        return cls(events[:, 0], events[:, 1], events[:, 2], velocity)
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def nbytes(self):
+        columns = self.start.nbytes + self.end.nbytes + self.pitch.nbytes + self.velocity.nbytes
+        return columns + (self._index.nbytes if self._index is not None else 0)
+
+    @property
+    def duration(self):
+        return float(self.end.max()) if len(self) else 0.0
+
+    @property
+    def index(self):
+        """IntervalIndex over the notes (built on first use; same order as the table)."""
+        if self._index is None:
+            self._index = IntervalIndex(self.start, self.end)
+        return self._index
+
+    def transposed(self, semitones):
+        """Copy shifted by semitones; notes pushed outside the MIDI range are dropped."""
+        if not semitones:
+            return self
+        pitch = self.pitch.astype(np.int16) + semitones
+        keep = (pitch >= 0) & (pitch <= 127)
+        return NoteTable(self.start[keep], self.end[keep], pitch[keep], self.velocity[keep])
+
+    def sounding(self, t):
+        """Names of the notes sounding at time t, lowest first."""
+        return NOTE_NAMES[np.sort(self.pitch[self.index.at(t)])].tolist()
+
+    def range(self, t0, t1):
+        """Index range [lo, hi) of notes starting in [t0, t1) (binary search, O(log n))."""
+        lo = int(np.searchsorted(self.start, t0, side="left"))
+        hi = int(np.searchsorted(self.start, t1, side="left"))
+        return lo, hi
+
+    def rows(self, lo=0, hi=None, chords=None):
+        """Playback Guide rows for notes lo..hi only.
+
+        chords is an optional IntervalIndex of chord segments; each note then gets
+        the chord it starts in.
+        """
+        hi = len(self) if hi is None else hi
+        starts = np.round(self.start[lo:hi].astype(np.float64), 2)
+        lengths = np.round((self.end[lo:hi] - self.start[lo:hi]).astype(np.float64), 2)
+        names = NOTE_NAMES[self.pitch[lo:hi]]
+        rows = [
+            {"Timestamp (s)": float(s), "Note": str(n), "Duration (s)": float(d)}
+            for s, n, d in zip(starts, names, lengths)
+        ]
+        if chords is not None:
+            for row, chord in zip(rows, chords.labels_at(self.start[lo:hi])):
+                row["Chord"] = str(chord)
+        return rows
+
+    def records(self):
+        """All notes as JSON friendly dicts (start, end, pitch, note, velocity)."""
+        return [
+            {"start": s, "end": e, "pitch": p, "note": str(n), "velocity": v}
+            for s, e, p, n, v in zip(
+                np.round(self.start.astype(np.float64), 3).tolist(),
+                np.round(self.end.astype(np.float64), 3).tolist(),
+                self.pitch.tolist(),
+                NOTE_NAMES[self.pitch],
+                self.velocity.tolist(),
+            )
+        ]
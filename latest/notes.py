@@ -0,0 +1,7 @@
+"""Note naming shared by the UI, streaming and export tools."""
+
+
+def get_note_name(midi_number):
+    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+    octave = (midi_number // 12) - 1
+    return f"{notes[midi_number % 12]}{octave}"
@@ -0,0 +1,323 @@
+"""Memoized preprocessing pipeline of named stages (app_v3's process_and_recognize as a graph).
+
+Each Stage names the stages it reads from and its own parameters. Its output is
+memoized under a key made of the stage name, its parameters and the keys of
+its inputs, so the key changes exactly when something upstream changes:
+
+    source -> load -> preemphasis -> hpss -> normalize -> recognize
+                   \\-> spectrogram
+
+Changing the HPSS margin recomputes hpss, normalize and recognize; switching the
+chord engine recomputes only recognize; running again with the same settings
+(in this process or a later one: chord_pipeline keeps stage outputs on disk
+next to the audio's features) is all cache hits, and stages that are not needed (inputs of a hit) are not
+even loaded. Stages whose inputs are ready run concurrently on a shared thread
+pool (librosa/numpy release the GIL in their heavy loops).
+
+    python latest/pipeline.py song.mp3 --margin 2 3 --engine chordino autochord
+
+runs every combination in one process and prints which stages were hits.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from startup import lazy_import, resource
+
+WORKERS = int(os.environ.get("CHORDIA_PIPELINE_WORKERS", "4"))
+
+
+class Stage:
+    """fn(*input values, **params) -> output. memo=False for stages that are already cheap to rerun."""
+
+    def __init__(self, name, fn, inputs=(), params=None, memo=True, version=1):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.params = dict(params or {})
+        self.memo = memo
+        # Bump when fn changes, so results of the old code are not reused
+        self.version = version
+
+
+class FeatureCache:
+    """Stage outputs of one source as files in its feature store directory (see FeatureStore.save)."""
+
+    def __init__(self, store, source_key):
+        self.store = store
+        self.source_key = source_key
+
+    def get(self, name):
+        value = self.store.load(self.source_key, name)
+        if isinstance(value, list):
+            # JSON has no tuples; results such as chord segments are lists of tuples
+            value = [tuple(item) if isinstance(item, list) else item for item in value]
+        return value
+
+    def put(self, name, value):
+        self.store.save(self.source_key, name, value)
+
+
+class Pipeline:
+    """A graph of stages over one source, memoized in cache (a dict, an ArtifactScope, or a
+    callable cache(source_key) returning either, e.g. a FeatureCache)."""
+
+    def __init__(self, stages, cache=None, prefix="stage_"):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [name for name in stage.inputs if name != "source" and name not in self.stages]
+            if missing:
+                raise ValueError(f"stage {stage.name!r} reads unknown stages {missing}")
+        self.order = self._topological_order()
+        self.cache = {} if cache is None else cache
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def _topological_order(self):
+        order, state = [], {}
+
+        def visit(name):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"pipeline has a cycle through {name!r}")
+            state[name] = "visiting"
+            for dependency in self.stages[name].inputs:
+                if dependency != "source":
+                    visit(dependency)
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def params(self, overrides=None):
+        """{stage: params} with overrides ({stage: {param: value}}) applied."""
+        overrides = overrides or {}
+        unknown = set(overrides) - set(self.stages)
+        if unknown:
+            raise ValueError(f"unknown stages {sorted(unknown)}")
+        params = {}
+        for name, stage in self.stages.items():
+            bad = set(overrides.get(name, {})) - set(stage.params)
+            if bad:
+                raise TypeError(f"unexpected parameters for {name}: {sorted(bad)}")
+            params[name] = dict(stage.params, **overrides.get(name, {}))
+        return params
+
+    def keys(self, source_key, params):
+        """Memo key of every stage: a hash of its name, version, params and input keys."""
+        keys = {"source": source_key}
+        for name in self.order:
+            stage = self.stages[name]
+            spec = [name, stage.version, params[name], [keys[i] for i in stage.inputs]]
+            keys[name] = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        return keys
+
+    def run(self, source, source_key, targets=None, overrides=None):
+        """Runs what is needed for targets (default: every stage without dependents).
+
+        Returns ({target: output}, report) where report lists
+        {"stage", "status": "hit" | "computed" | "skipped", "seconds"} in stage order.
+        """
+        targets = list(targets or self._sinks())
+        params = self.params(overrides)
+        cache = self.cache(source_key) if callable(self.cache) else self.cache
+        keys = self.keys(source_key, params)
+        values = {"source": source}
+        status, seconds = {}, {}
+
+        # Walk down from the targets: a cached stage does not need its inputs
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in needed or name == "source":
+                continue
+            needed.add(name)
+            cached = self._cached(cache, name, keys[name]) if self.stages[name].memo else None
+            if cached is not None:
+                values[name] = cached
+                status[name] = "hit"
+            else:
+                stack.extend(self.stages[name].inputs)
+
+        pending = [name for name in self.order if name in needed and name not in values]
+        running = {}
+        pool = _pool()
+        try:
+            while pending or running:
+                for name in [n for n in pending if all(i in values for i in self.stages[n].inputs)]:
+                    pending.remove(name)
+                    inputs = [values[i] for i in self.stages[name].inputs]
+                    running[pool.submit(_timed, self.stages[name].fn, inputs, params[name])] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    values[name], seconds[name] = future.result()
+                    status[name] = "computed"
+                    if self.stages[name].memo:
+                        self._store(cache, name, keys[name], values[name])
+        finally:
+            for future in running:
+                future.cancel()
+
+        report = [
+            {"stage": name, "status": status.get(name, "skipped"), "seconds": round(seconds.get(name, 0.0), 3)}
+            for name in self.order
+        ]
+        return {name: values[name] for name in targets}, report
+
+    def _sinks(self):
+        used = {i for stage in self.stages.values() for i in stage.inputs}
+        return [name for name in self.order if name not in used]
+
+    def _cached(self, cache, name, key):
+        return cache.get(f"{self.prefix}{name}_{key}")
+
+    def _store(self, cache, name, key, value):
+        with self._lock:
+            if isinstance(cache, dict):
+                cache[f"{self.prefix}{name}_{key}"] = value
+            else:
+                cache.put(f"{self.prefix}{name}_{key}", value)
+
+
+def _timed(fn, inputs, params):
+    started = time.perf_counter()
+    return fn(*inputs, **params), time.perf_counter() - started
+
+
+def _pool():
+    return resource("pipeline_pool", lambda: ThreadPoolExecutor(
+        max_workers=WORKERS, thread_name_prefix="chordia-pipeline"
+    ))
+
+
+# --- APP_V3 CHORD PIPELINE ---
+# load -> pre-emphasis -> HPSS -> normalize -> chord recognition, plus the
+# spectrogram shown next to the chords (independent of the cleaning branch).
+
+def _load(path):
+    # Decoded once per audio file and memory-mapped by the feature store
+    features = lazy_import("features")
+    store = features.get_feature_store()
+    return store.get(store.add_audio(path), "pcm")
+
+def _preemphasis(y, coef):
+    return lazy_import("librosa").effects.preemphasis(y, coef=coef)
+
+def _hpss(y, margin):
+    # Harmonic part only: drums are what throw chord recognition off
+    return lazy_import("librosa").effects.hpss(y, margin=margin)[0]
+
+def _normalize(y):
+    return lazy_import("librosa").util.normalize(y)
+
+def _recognize(y, engine, skip_silence=True):
+    """Chord segments [(start, end, chord), ...] from the engine, which reads a WAV file.
+
+    autochord's output is returned as is, 'N' (no chord) included, as in app_v3;
+    chordino's is extract_chords' (without 'N'). With skip_silence only the active
+    parts (see activity.py) go to the engine; for autochord the skipped stretches
+    come back as 'N'.
+    """
+    activity = lazy_import("activity")
+    sr = lazy_import("features").SAMPLE_RATE
+    timeline = activity.detect_activity(y, sr) if skip_silence else None
+    if timeline is None or not timeline.worth_skipping():
+        return _run_engine(y, engine)
+    segments = timeline.segments(_run_engine(timeline.compact(y, sr), engine)) if len(timeline.regions) else []
+    return _fill_no_chord(segments, timeline.duration) if engine == "autochord" else segments
+
+def _run_engine(y, engine):
+    sf = lazy_import("soundfile")
+    features = lazy_import("features")
+    fd, path = tempfile.mkstemp(suffix=".wav", prefix="chordia_clean_")
+    os.close(fd)
+    try:
+        sf.write(path, y, features.SAMPLE_RATE)
+        if engine == "autochord":
+            return [tuple(chord) for chord in lazy_import("autochord").recognize(path)]
+        if engine == "chordino":
+            return lazy_import("chords").extract_chords(path)
+        raise ValueError(f"unknown chord engine {engine!r}; expected 'chordino' or 'autochord'")
+    finally:
+        os.remove(path)
+
+def _fill_no_chord(segments, duration):
+    """segments with the uncovered stretches of [0, duration] as 'N', adjacent 'N's merged."""
+    out = []
+    for start, end, label in segments + [(duration, duration, None)]:
+        t = out[-1][1] if out else 0.0
+        if start > t + 1e-6:
+            if out and out[-1][2] == "N":
+                out[-1] = (out[-1][0], start, "N")
+            else:
+                out.append((t, start, "N"))
+        if label is None:
+            break
+        if label == "N" and out and out[-1][2] == "N":
+            out[-1] = (out[-1][0], end, "N")
+        else:
+            out.append((start, end, label))
+    return out
+
+def _spectrogram(y, n_fft):
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    return librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=n_fft)), ref=np.max)
+
+def chord_pipeline(cache=None):
+    """app_v3's process_and_recognize, with the same defaults (autochord), as memoized stages.
+
+    By default stage outputs are kept in the feature store, so they outlive the
+    process and are shared with every other process on the host.
+    """
+    if cache is None:
+        cache = lambda source_key: FeatureCache(lazy_import("features").get_feature_store(), source_key)
+    return Pipeline([
+        Stage("load", _load, ["source"], memo=False),
+        Stage("preemphasis", _preemphasis, ["load"], {"coef": 0.97}),
+        Stage("hpss", _hpss, ["preemphasis"], {"margin": 2.0}),
+        Stage("normalize", _normalize, ["hpss"]),
+        # version 2: autochord by default and its 'N' segments kept, as in app_v3
+        Stage("recognize", _recognize, ["normalize"], {"engine": "autochord", "skip_silence": True}, version=2),
+        Stage("spectrogram", _spectrogram, ["load"], {"n_fft": 2048}),
+    ], cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chord pipeline and show which stages were cached")
+    parser.add_argument("audio")
+    parser.add_argument("--margin", type=float, nargs="+", default=[2.0], help="HPSS margin(s) to try")
+    parser.add_argument("--coef", type=float, nargs="+", default=[0.97], help="pre-emphasis coefficient(s)")
+    parser.add_argument("--engine", nargs="+", default=["autochord"], choices=["chordino", "autochord"])
+    parser.add_argument("--keep-silence", action="store_true", help="send silent and noise-only parts to the engine too")
+    parser.add_argument("--targets", nargs="+", default=None, help="stages to produce (default: all outputs)")
+    args = parser.parse_args()
+
+    pipeline = chord_pipeline()
+    source_key = lazy_import("features").audio_key(args.audio)
+    for coef in args.coef:
+        for margin in args.margin:
+            for engine in args.engine:
+                overrides = {"preemphasis": {"coef": coef}, "hpss": {"margin": margin},
+                             "recognize": {"engine": engine, "skip_silence": not args.keep_silence}}
+                started = time.perf_counter()
+                outputs, report = pipeline.run(args.audio, source_key, args.targets, overrides)
+                print(f"coef={coef} margin={margin} engine={engine}: {time.perf_counter() - started:.2f}s")
+                for row in report:
+                    print(f"  {row['stage']:<12} {row['status']:<9} {row['seconds']:.3f}s")
+                if "recognize" in outputs:
+                    print(f"  {len(outputs['recognize'])} chord segments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""CPU-only source separation run before transcription.
+
+Splits a track into vocals / accompaniment (librosa's REPET-SIM style
+nearest-neighbour filtering: the repeating background is what similar frames
+have in common, the voice is what is left) and splits the accompaniment into
+harmonic / percussive parts (HPSS, as app_v3 did on the full mix). Long tracks
+are processed in overlapping chunks that are cross-faded back together, so
+memory stays bounded by the chunk size.
+
+Stems are cached per upload in the artifact store, so switching instrument
+mode reuses them instead of separating again.
+"""
+import io
+import time
+
+from engine import SAMPLE_RATE
+from startup import lazy_import
+
+STEMS = ("vocals", "accompaniment", "harmonic", "percussive")
+# Which stem each instrument mode of app-latest transcribes
+MODE_STEMS = {
+    "Guitar/Violin (Polyphonic)": "harmonic",
+    "Bass Guitar": "harmonic",
+    "Piano": "harmonic",
+    "Drums (Beat Only)": "percussive",
+}
+N_FFT = 2048
+HOP_LENGTH = 512
+
+
+def separate_chunk(y, sr=SAMPLE_RATE, margin_background=2, margin_vocals=10, hpss_margin=2.0):
+    """Separates one chunk of mono audio into the four STEMS (same length as y)."""
+    np = lazy_import("numpy")
+    librosa = lazy_import("librosa")
+    D = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+    S = np.abs(D)
+
+    # Background estimate: median of the most similar frames at least 2 s away
+    width = int(librosa.time_to_frames(2, sr=sr, hop_length=HOP_LENGTH))
+    if S.shape[1] > 2 * width:
+        S_background = librosa.decompose.nn_filter(S, aggregate=np.median, metric="cosine", width=width)
+        S_background = np.minimum(S, S_background)
+    else:
+        S_background = S  # too short to find repetitions: treat everything as accompaniment
+    mask_background = librosa.util.softmask(S_background, margin_background * (S - S_background), power=2)
+    mask_vocals = librosa.util.softmask(S - S_background, margin_vocals * S_background, power=2)
+
+    D_accompaniment = mask_background * D
+    D_harmonic, D_percussive = librosa.decompose.hpss(D_accompaniment, margin=hpss_margin)
+    spectra = {
+        "vocals": mask_vocals * D,
+        "accompaniment": D_accompaniment,
+        "harmonic": D_harmonic,
+        "percussive": D_percussive,
+    }
+    return {name: librosa.istft(spec, hop_length=HOP_LENGTH, length=len(y)) for name, spec in spectra.items()}
+
+def separate(y, sr=SAMPLE_RATE, chunk_seconds=30.0, overlap_seconds=2.0, **options):
+    """Chunked separate_chunk over a whole track; chunks are linearly cross-faded."""
+    np = lazy_import("numpy")
+    y = np.asarray(y, dtype=np.float32)
+    chunk = int(chunk_seconds * sr)
+    overlap = min(int(overlap_seconds * sr), chunk // 2)
+    if len(y) <= chunk:
+        return {name: stem.astype(np.float32) for name, stem in separate_chunk(y, sr, **options).items()}
+
+    stems = {name: np.zeros(len(y), dtype=np.float32) for name in STEMS}
+    norm = np.zeros(len(y), dtype=np.float32)
+    ramp = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+    for start in range(0, len(y) - overlap, chunk - overlap):
+        piece = y[start:start + chunk]
+        weights = np.ones(len(piece), dtype=np.float32)
+        if start > 0:
+            weights[:overlap] = ramp[:len(piece)]
+        if start + chunk < len(y):
+            weights[-overlap:] = ramp[::-1]
+        for name, stem in separate_chunk(piece, sr, **options).items():
+            stems[name][start:start + len(piece)] += weights * stem
+        norm[start:start + len(piece)] += weights
+    return {name: stem / np.maximum(norm, 1e-6) for name, stem in stems.items()}
+
+def encode_wav(y, sr=SAMPLE_RATE):
+    sf = lazy_import("soundfile")
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format="WAV", subtype="FLOAT")
+    return buffer.getvalue()
+
+
+# --- CACHED STEMS ---
+
+def get_stems(store, owner, audio):
+    """Paths of the owner's stems (WAV files in the artifact store), separating mono
+    SAMPLE_RATE audio on first use.
+
+    Returns (paths by stem name, separation seconds), with seconds None when
+    the stems came from the cache.
+    """
+    paths = {name: store.path(owner, f"stem_{name}") for name in STEMS}
+    if all(paths.values()):
+        return paths, None
+    started = time.perf_counter()
+    stems = separate(audio)
+    elapsed = time.perf_counter() - started
+    for name, stem in stems.items():
+        store.put(owner, f"stem_{name}", encode_wav(stem), on_disk=True, suffix=".wav")
+        paths[name] = store.path(owner, f"stem_{name}")
+    return paths, elapsed
@@ -0,0 +1,246 @@
+"""Sheet-music export (MusicXML and ABC) for note events.
+
+Works on a NoteTable, so it takes Basic Pitch and PianoTranscription results
+alike. Notes are quantized to a beat grid detected from the note onsets, then
+written one measure at a time to a text stream: no document tree is built, the
+only per-note state is a few numpy columns, and export time grows linearly with
+the number of notes.
+
+    with open("song.musicxml", "w", encoding="utf-8") as f:
+        write_musicxml(table, f, title="Song")
+
+Each measure is "chordified" for a readable practice sheet: notes starting on the
+same grid position form a chord, and a chord lasts until the next onset or the
+bar line, whichever comes first. Durations that have no single note value are
+written as tied notes.
+"""
+import math
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+STEPS = [('C', 0), ('C', 1), ('D', 0), ('D', 1), ('E', 0), ('F', 0), ('F', 1), ('G', 0), ('G', 1), ('A', 0), ('A', 1), ('B', 0)]
+# MusicXML note types by length in quarter notes
+NOTE_TYPES = [("whole", 4.0), ("half", 2.0), ("quarter", 1.0), ("eighth", 0.5), ("16th", 0.25), ("32nd", 0.125)]
+
+
+# --- BEAT GRID ---
+
+def detect_grid(start, velocity=None, fps=100, min_bpm=50, max_bpm=200):
+    """Estimates (bpm, offset_s) from note onsets.
+
+    Tempo is the strongest autocorrelation lag of an onset-strength envelope
+    (weighted toward ~120 BPM, like librosa's tempo prior); the offset is the
+    circular mean of the onset phases at that period.
+    """
+    start = np.asarray(start, dtype=np.float64)
+    if len(start) < 4:
+        return 120.0, float(start.min()) if len(start) else 0.0
+    weights = np.ones_like(start) if velocity is None else np.asarray(velocity, dtype=np.float64) + 1
+    frames = np.round((start - start.min()) * fps).astype(np.int64)
+    envelope = np.bincount(frames, weights=weights)
+    envelope = np.convolve(envelope, [0.25, 0.5, 0.25], mode="same")
+    envelope -= envelope.mean()
+    n = len(envelope)
+    # Power-of-two FFT size: arbitrary lengths can hit numpy's slow paths
+    n_fft = 1 << (2 * n - 1).bit_length()
+    autocorr = np.fft.irfft(np.abs(np.fft.rfft(envelope, n_fft)) ** 2, n_fft)[:n]
+
+    lags = np.arange(math.ceil(60 * fps / max_bpm), math.floor(60 * fps / min_bpm) + 1)
+    lags = lags[lags < n - 1]
+    if not len(lags):
+        return 120.0, float(start.min())
+    bpms = 60 * fps / lags
+    score = autocorr[lags] * np.exp(-0.5 * np.log2(bpms / 120) ** 2)
+    best = int(np.argmax(score))
+    lag = float(lags[best])
+    if 0 < best < len(lags) - 1:
+        # Parabolic interpolation for a sub-frame period
+        a, b, c = autocorr[lags[best] - 1], autocorr[lags[best]], autocorr[lags[best] + 1]
+        if a - 2 * b + c < 0:
+            lag += 0.5 * (a - c) / (a - 2 * b + c)
+    period = lag / fps
+
+    phase = np.angle(np.sum(weights * np.exp(2j * np.pi * start / period)))
+    offset = (phase / (2 * np.pi)) * period % period
+    # First grid line at or before the first note
+    offset -= math.ceil((offset - start.min()) / period) * period
+    return 60.0 / period, float(offset)
+
+def quantize(table, bpm, offset, divisions=4):
+    """Grid positions (in 1/divisions of a quarter note) of every note's start and end."""
+    step = 60.0 / bpm / divisions
+    starts = np.maximum(np.round((table.start - offset) / step), 0).astype(np.int64)
+    ends = np.maximum(np.round((table.end - offset) / step).astype(np.int64), starts + 1)
+    return starts, ends
+
+
+# --- MEASURES ---
+
+def _note_values(divisions):
+    """{duration in divisions: (type, dots)} for every plain or dotted note value on the grid."""
+    values = {}
+    for name, quarters in NOTE_TYPES:
+        for dots, factor in ((0, 1.0), (1, 1.5)):
+            length = quarters * factor * divisions
+            if length >= 1 and length == int(length):
+                values.setdefault(int(length), (name, dots))
+    return values
+
+def _split(duration, values):
+    """Greedy split of a duration into representable note values (tied when more than one)."""
+    lengths = sorted(values, reverse=True)
+    pieces = []
+    while duration > 0:
+        piece = next(length for length in lengths if length <= duration)
+        pieces.append(piece)
+        duration -= piece
+    return pieces
+
+def iter_measures(table, bpm=None, offset=None, divisions=4, beats=4):
+    """Yields (measure_number, events) per measure, where events are
+    ("rest", duration) or ("chord", pitches, duration), durations in divisions.
+
+    Measures are produced lazily from binary searches over the quantized starts.
+    """
+    if bpm is None or offset is None:
+        bpm, offset = detect_grid(table.start, table.velocity)
+    starts, ends = quantize(table, bpm, offset, divisions)
+    measure_len = beats * divisions
+    n_measures = max(1, -(-int(ends.max()) // measure_len)) if len(table) else 1
+    bounds = np.searchsorted(starts, np.arange(n_measures + 1) * measure_len, side="left")
+
+    for m in range(n_measures):
+        lo, hi = int(bounds[m]), int(bounds[m + 1])
+        bar_start, bar_end = m * measure_len, (m + 1) * measure_len
+        onsets, first = np.unique(starts[lo:hi], return_index=True)
+        group_ends = np.maximum.reduceat(ends[lo:hi], first) if hi > lo else first
+        next_onsets = np.append(onsets[1:], bar_end)
+        events, cursor = [], bar_start
+        for onset, start_idx, stop_idx, end, next_onset in zip(
+            onsets.tolist(), first.tolist(), np.append(first[1:], hi - lo).tolist(),
+            np.asarray(group_ends).tolist(), next_onsets.tolist(),
+        ):
+            if onset > cursor:
+                events.append(("rest", onset - cursor))
+            pitches = sorted(set(table.pitch[lo + start_idx:lo + stop_idx].tolist()))
+            duration = min(end, next_onset, bar_end) - onset
+            events.append(("chord", pitches, duration))
+            cursor = onset + duration
+        if cursor < bar_end:
+            events.append(("rest", bar_end - cursor))
+        yield m + 1, events
+
+
+# --- MUSICXML ---
+
+def _xml_notes(pitches, duration, values):
+    pieces = _split(duration, values)
+    out = []
+    for k, piece in enumerate(pieces):
+        kind, dots = values[piece]
+        tie_stop, tie_start = k > 0, k < len(pieces) - 1
+        for j, pitch in enumerate(pitches if pitches is not None else [None]):
+            parts = ["<note>"]
+            if j:
+                parts.append("<chord/>")
+            if pitch is None:
+                parts.append("<rest/>")
+            else:
+                step, alter = STEPS[pitch % 12]
+                parts.append(f"<pitch><step>{step}</step>{'<alter>1</alter>' if alter else ''}"
+                             f"<octave>{pitch // 12 - 1}</octave></pitch>")
+            parts.append(f"<duration>{piece}</duration>")
+            if pitch is not None:
+                parts += ['<tie type="stop"/>'] * tie_stop + ['<tie type="start"/>'] * tie_start
+            parts.append(f"<voice>1</voice><type>{kind}</type>" + "<dot/>" * dots)
+            if pitch is not None and (tie_stop or tie_start):
+                parts.append("<notations>" + '<tied type="stop"/>' * tie_stop + '<tied type="start"/>' * tie_start
+                             + "</notations>")
+            parts.append("</note>")
+            out.append("".join(parts))
+    return out
+
+def write_musicxml(table, stream, title="Chordia Transcription", bpm=None, offset=None, divisions=4, beats=4):
+    """Writes a single-part MusicXML 4.0 score to a text stream, one measure at a time."""
+    if bpm is None or offset is None:
+        bpm, offset = detect_grid(table.start, table.velocity)
+    values = _note_values(divisions)
+    bass = len(table) and float(np.median(table.pitch)) < 60
+    clef = "<sign>F</sign><line>4</line>" if bass else "<sign>G</sign><line>2</line>"
+    stream.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+        '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+        '<score-partwise version="4.0">\n'
+        f"<work><work-title>{escape(title)}</work-title></work>\n"
+        "<identification><encoding><software>Chordia</software></encoding></identification>\n"
+        '<part-list><score-part id="P1"><part-name>Transcription</part-name></score-part></part-list>\n'
+        '<part id="P1">\n'
+    )
+    for number, events in iter_measures(table, bpm, offset, divisions, beats):
+        lines = [f'<measure number="{number}">']
+        if number == 1:
+            lines.append(
+                f"<attributes><divisions>{divisions}</divisions><key><fifths>0</fifths></key>"
+                f"<time><beats>{beats}</beats><beat-type>4</beat-type></time><clef>{clef}</clef></attributes>"
+            )
+            lines.append(
+                '<direction placement="above"><direction-type><metronome><beat-unit>quarter</beat-unit>'
+                f"<per-minute>{round(bpm)}</per-minute></metronome></direction-type>"
+                f'<sound tempo="{round(bpm, 2)}"/></direction>'
+            )
+        for event in events:
+            if event[0] == "rest":
+                lines += _xml_notes(None, event[1], values)
+            else:
+                lines += _xml_notes(event[1], event[2], values)
+        lines.append("</measure>\n")
+        stream.write("\n".join(lines))
+    stream.write("</part>\n</score-partwise>\n")
+
+
+# --- ABC ---
+
+def _abc_pitch(pitch, accidentals):
+    """ABC pitch for a MIDI note; accidentals tracks what is already in force in the bar."""
+    step, alter = STEPS[pitch % 12]
+    octave = pitch // 12 - 1
+    prefix = ""
+    if accidentals.get((step, octave), 0) != alter:
+        prefix = "^" if alter else "="
+        accidentals[(step, octave)] = alter
+    if octave >= 5:
+        return prefix + step.lower() + "'" * (octave - 5)
+    return prefix + step + "," * (4 - octave)
+
+def write_abc(table, stream, title="Chordia Transcription", bpm=None, offset=None, divisions=4, beats=4,
+              measures_per_line=4):
+    """Writes ABC notation to a text stream, one measure at a time."""
+    if bpm is None or offset is None:
+        bpm, offset = detect_grid(table.start, table.velocity)
+    values = _note_values(divisions)
+    bass = len(table) and float(np.median(table.pitch)) < 60
+    stream.write(
+        f"X:1\nT:{title}\nM:{beats}/4\nL:1/{4 * divisions}\nQ:1/4={round(bpm)}\n"
+        f"K:C{' clef=bass' if bass else ''}\n"
+    )
+    line = []
+    for number, events in iter_measures(table, bpm, offset, divisions, beats):
+        accidentals = {}
+        tokens = []
+        for event in events:
+            if event[0] == "rest":
+                tokens += [f"z{piece if piece != 1 else ''}" for piece in _split(event[1], values)]
+                continue
+            pitches, duration = event[1], event[2]
+            names = [_abc_pitch(p, accidentals) for p in pitches]
+            head = names[0] if len(names) == 1 else "[" + "".join(names) + "]"
+            pieces = _split(duration, values)
+            tokens.append("-".join(f"{head}{piece if piece != 1 else ''}" for piece in pieces))
+        line.append(" ".join(tokens))
+        if number % measures_per_line == 0:
+            stream.write(" | ".join(line) + " |\n")
+            line = []
+    if line:
+        stream.write(" | ".join(line) + " |\n")
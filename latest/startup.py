@@ -0,0 +1,138 @@
+"""Lazy imports, background preloading and startup timings for Chordia."""
+import importlib
+import subprocess
+import sys
+import threading
+import time
+
+# Heavy modules the UI only needs once a file is uploaded / analyzed
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "matplotlib.pyplot",
+    "librosa",
+    "librosa.display",
+    "basic_pitch.inference",
+]
+
+_started_at = time.perf_counter()
+_lock = threading.Lock()
+_timings = []
+_marks = set()
+_resources = {}
+_resource_locks = {}
+_preload_thread = None
+
+
+def _record(step, seconds, thread=None):
+    with _lock:
+        _timings.append({
+            "Step": step,
+            "Seconds": round(seconds, 3),
+            "Thread": thread or threading.current_thread().name,
+        })
+
+
+def lazy_import(name):
+    """Imports a module at the point of use and records the cost of the first import."""
+    already_loaded = name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if not already_loaded:
+        _record(f"import {name}", time.perf_counter() - start)
+    return module
+
+
+def resource(key, factory):
+    """Builds a process-wide resource (e.g. a model) once and hands back the same instance."""
+    with _lock:
+        if key in _resources:
+            return _resources[key]
+        key_lock = _resource_locks.setdefault(key, threading.Lock())
+
+    # Per-key lock so a UI rerun waits for an in-progress preload instead of loading twice
+    with key_lock:
+        with _lock:
+            if key in _resources:
+                return _resources[key]
+        start = time.perf_counter()
+        value = factory()
+        _record(f"load {key}", time.perf_counter() - start)
+        with _lock:
+            _resources[key] = value
+        return value
+
+
+def mark_once(step):
+    """Records the time since process start the first time a step is reached (e.g. page served)."""
+    with _lock:
+        if step in _marks:
+            return
+        _marks.add(step)
+    _record(step, time.perf_counter() - _started_at)
+
+
+def preload_in_background(tasks):
+    """Runs (label, callable) tasks in a daemon thread, once per process."""
+    global _preload_thread
+    with _lock:
+        if _preload_thread is not None:
+            return _preload_thread
+        _preload_thread = threading.Thread(
+            target=_run_preload, args=(list(tasks),), name="chordia-preload", daemon=True
+        )
+    _preload_thread.start()
+    return _preload_thread
+
+
+def _run_preload(tasks):
+    start = time.perf_counter()
+    for label, task in tasks:
+        try:
+            task()
+        except Exception as e:
+            print(f"[chordia] preload of {label} failed: {e}", file=sys.stderr)
+    _record("preload finished", time.perf_counter() - start)
+    print(format_report(), file=sys.stderr)
+
+
+def preload_done():
+    return _preload_thread is not None and not _preload_thread.is_alive()
+
+
+def startup_report():
+    """Returns the recorded timings as a list of dicts (ready for st.dataframe)."""
+    with _lock:
+        return list(_timings)
+
+
+def format_report():
+    lines = ["[chordia] startup timings:"]
+    for row in startup_report():
+        lines.append(f"  {row['Seconds']:>8.3f}s  {row['Step']}  ({row['Thread']})")
+    return "\n".join(lines)
+
+
+# --- COLD IMPORT BENCHMARK ---
+# `python latest/startup.py` times each heavy import in a fresh interpreter,
+# so import regressions show up without starting Streamlit.
+
+def measure_cold_imports(modules=HEAVY_MODULES):
+    results = []
+    for name in modules:
+        code = (
+            "import time; s = time.perf_counter(); "
+            f"import {name}; print(time.perf_counter() - s)"
+        )
+        proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if proc.returncode == 0:
+            results.append((name, float(proc.stdout.strip().splitlines()[-1])))
+        else:
+            results.append((name, None))
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in measure_cold_imports():
+        shown = "not installed" if seconds is None else f"{seconds:.3f}s"
+        print(f"{name:<24} {shown}")
@@ -0,0 +1,294 @@
+"""Live transcription from a streaming audio source (microphone or a file replayed as a stream).
+
+    python latest/streaming.py song.wav --realtime      # replay a file at playback speed
+    python latest/streaming.py --mic                    # needs `pip install sounddevice`
+
+Audio arrives in small blocks. Every `hop` seconds the latest Basic Pitch window
+is run through the model, the newly settled frames are appended to a sliding
+history of `window` seconds, and Basic Pitch's note decoding over that history
+is diffed against the currently sounding notes to emit note-on / note-off events.
+"""
+import argparse
+import queue
+import time
+
+import numpy as np
+
+import engine
+from startup import lazy_import
+from notes import get_note_name
+
+
+class StreamingTranscriber:
+    """Incremental Basic Pitch transcription with bounded latency.
+
+    window_seconds    decoded history used for note tracking (bounds decode cost)
+    hop_seconds       how often the model runs; smaller hops = lower latency, more CPU
+    lookahead_frames  frames at the right edge of the model window held back until the
+                      next hop, since activations there are the least reliable
+    release_frames    a note still counts as sounding if it ends this close to the edge
+    """
+
+    def __init__(self, predict=None, window_seconds=1.0, hop_seconds=0.25, lookahead_frames=8,
+                 release_frames=2, onset_threshold=0.5, frame_threshold=0.3,
+                 minimum_note_length_ms=58.0, melodia_trick=False):
+        c = engine.constants()
+        self.sample_rate = c.AUDIO_SAMPLE_RATE
+        self.fft_hop = c.FFT_HOP
+        self.window_samples = c.AUDIO_N_SAMPLES
+        self.predict = predict or engine.get_predictor()
+
+        # Keep hops frame-aligned so absolute frame indexes stay integral
+        max_hop = self.window_samples - (lookahead_frames + 1) * self.fft_hop
+        hop_samples = int(round(hop_seconds * self.sample_rate / self.fft_hop)) * self.fft_hop
+        self.hop_samples = min(max(self.fft_hop, hop_samples), max_hop // self.fft_hop * self.fft_hop)
+        self.history_frames = max(1, int(window_seconds * self.sample_rate / self.fft_hop))
+        self.lookahead_frames = lookahead_frames
+        self.release_frames = release_frames
+        self.decode_options = {
+            "onset_threshold": onset_threshold,
+            "frame_threshold": frame_threshold,
+            "minimum_note_length_ms": minimum_note_length_ms,
+            "melodia_trick": melodia_trick,
+        }
+
+        self.audio = np.zeros(self.window_samples, dtype=np.float32)
+        self.samples_seen = 0
+        self.pending_samples = 0
+        self.pending_blocks = []
+        self.committed_frame = 0
+        self.history_start = 0
+        self.note_history = None
+        self.onset_history = None
+        self.active = {}
+        self.block_latencies_ms = []
+        self.compute_ms = []
+
+    @property
+    def algorithmic_latency_ms(self):
+        """Latency added by buffering a hop plus the held-back lookahead, before any compute."""
+        return 1000.0 * (self.hop_samples + self.lookahead_frames * self.fft_hop) / self.sample_rate
+
+    def push(self, block, arrived_at=None):
+        """Adds one block of mono float audio at AUDIO_SAMPLE_RATE; returns the events it completed."""
+        arrived_at = time.perf_counter() if arrived_at is None else arrived_at
+        block = np.asarray(block, dtype=np.float32).reshape(-1)
+        events = []
+        pos = 0
+        while pos < len(block):
+            take = min(len(block) - pos, self.hop_samples - self.pending_samples)
+            self._append(block[pos:pos + take])
+            pos += take
+            if pos == len(block):
+                self.pending_blocks.append(arrived_at)
+            if self.pending_samples >= self.hop_samples:
+                events.extend(self._analyze())
+        return events
+
+    def finish(self):
+        """Flushes the remaining audio and closes every note that is still sounding."""
+        events = []
+        tail = self.hop_samples - self.pending_samples + self.lookahead_frames * self.fft_hop
+        events.extend(self.push(np.zeros(tail, dtype=np.float32)))
+        while self.pending_samples:
+            events.extend(self.push(np.zeros(self.hop_samples - self.pending_samples, dtype=np.float32)))
+        last = self.committed_frame
+        for pitch in sorted(self.active):
+            events.append(self._event("note_off", pitch, last, 0.0))
+        self.active.clear()
+        return events
+
+    def latency_report(self):
+        """Per-block end-to-end latency (arrival -> events emitted, plus lookahead) and model compute."""
+        def summary(values):
+            if not values:
+                return {"p50": None, "p95": None, "max": None}
+            arr = np.asarray(values)
+            return {
+                "p50": round(float(np.percentile(arr, 50)), 1),
+                "p95": round(float(np.percentile(arr, 95)), 1),
+                "max": round(float(arr.max()), 1),
+            }
+        return {
+            "blocks": len(self.block_latencies_ms),
+            "hops": len(self.compute_ms),
+            "hop_ms": round(1000.0 * self.hop_samples / self.sample_rate, 1),
+            "algorithmic_ms": round(self.algorithmic_latency_ms, 1),
+            "latency_ms": summary(self.block_latencies_ms),
+            "compute_ms": summary(self.compute_ms),
+        }
+
+    # --- INTERNALS ---
+
+    def _append(self, chunk):
+        n = len(chunk)
+        self.audio[:-n] = self.audio[n:]
+        self.audio[-n:] = chunk
+        self.samples_seen += n
+        self.pending_samples += n
+
+    def _analyze(self):
+        started = time.perf_counter()
+        output = {k: v[0] for k, v in self.predict(self.audio[np.newaxis]).items()}
+        n_frames = output["note"].shape[0]
+
+        # Absolute frame index of row 0 of this model window (negative while the stream is short).
+        # Rounded, not floored: the window (AUDIO_N_SAMPLES) is not a whole number of hops, and
+        # flooring its start would put every window up to a frame early
+        offset = round((self.samples_seen - self.window_samples) / self.fft_hop)
+        first_row = max(0, self.committed_frame - offset)
+        last_row = n_frames - self.lookahead_frames
+        previous_commit = self.committed_frame
+        if last_row > first_row:
+            self._extend_history(output["note"][first_row:last_row], output["onset"][first_row:last_row])
+            self.committed_frame = offset + last_row
+
+        events = self._track_notes(previous_commit) if self.note_history is not None else []
+
+        done = time.perf_counter()
+        self.compute_ms.append(1000.0 * (done - started))
+        lookahead_ms = 1000.0 * self.lookahead_frames * self.fft_hop / self.sample_rate
+        self.block_latencies_ms.extend(1000.0 * (done - t) + lookahead_ms for t in self.pending_blocks)
+        self.pending_blocks = []
+        self.pending_samples = 0
+        return events
+
+    def _extend_history(self, note, onset):
+        if self.note_history is None:
+            self.history_start = self.committed_frame
+            self.note_history, self.onset_history = note, onset
+        else:
+            self.note_history = np.concatenate([self.note_history, note])
+            self.onset_history = np.concatenate([self.onset_history, onset])
+        excess = len(self.note_history) - self.history_frames
+        if excess > 0:
+            self.note_history = self.note_history[excess:]
+            self.onset_history = self.onset_history[excess:]
+            self.history_start += excess
+
+    def _track_notes(self, previous_commit):
+        decoded = engine.decode_notes(self.note_history, self.onset_history, **self.decode_options)
+        last = self.history_start + len(self.note_history) - 1
+
+        sounding = {}
+        finished = {}
+        for start, end, pitch, amplitude in decoded:
+            start, end, pitch = start + self.history_start, end + self.history_start, int(pitch)
+            if end >= last - self.release_frames:
+                if pitch not in sounding or start > sounding[pitch][0]:
+                    sounding[pitch] = (start, end, amplitude)
+            else:
+                finished.setdefault(pitch, []).append((start, end, amplitude))
+
+        events = []
+        for pitch in list(self.active):
+            if pitch not in sounding:
+                on_frame = self.active.pop(pitch)
+                ends = [end for start, end, _ in finished.get(pitch, []) if end >= on_frame]
+                events.append(self._event("note_off", pitch, max(ends) + 1 if ends else last, 0.0))
+        # Short notes that started and ended inside the frames committed by this hop
+        for pitch, spans in finished.items():
+            for start, end, amplitude in spans:
+                if start >= previous_commit:
+                    events.append(self._event("note_on", pitch, start, amplitude))
+                    events.append(self._event("note_off", pitch, end + 1, 0.0))
+        for pitch, (start, end, amplitude) in sounding.items():
+            if pitch not in self.active:
+                self.active[pitch] = start
+                events.append(self._event("note_on", pitch, start, amplitude))
+        return sorted(events, key=lambda e: (e["time"], e["type"] == "note_on"))
+
+    def _event(self, kind, pitch, frame, amplitude):
+        return {
+            "type": kind,
+            "time": round(float(engine.frames_to_seconds(frame)), 3),
+            "pitch": pitch,
+            "note": get_note_name(pitch),
+            "velocity": int(round(127 * float(amplitude))),
+        }
+
+
+# --- AUDIO SOURCES ---
+
+def file_blocks(path, block_size=1024, realtime=False):
+    """Replays an audio file as a stream of blocks (optionally paced at playback speed)."""
+    librosa = lazy_import("librosa")
+    sample_rate = engine.constants().AUDIO_SAMPLE_RATE
+    y, _ = librosa.load(path, sr=sample_rate, mono=True)
+    block_seconds = block_size / sample_rate
+    next_due = time.perf_counter()
+    for start in range(0, len(y), block_size):
+        if realtime:
+            next_due += block_seconds
+            time.sleep(max(0.0, next_due - time.perf_counter()))
+        yield y[start:start + block_size]
+
+def microphone_blocks(block_size=1024, device=None):
+    """Yields blocks from the default input device until interrupted."""
+    try:
+        import sounddevice as sd
+    except ImportError as e:
+        raise RuntimeError("Microphone input needs the optional 'sounddevice' package") from e
+    sample_rate = engine.constants().AUDIO_SAMPLE_RATE
+    blocks = queue.Queue()
+
+    def callback(indata, frames, time_info, status):
+        blocks.put(indata[:, 0].copy())
+
+    with sd.InputStream(samplerate=sample_rate, blocksize=block_size, channels=1,
+                        dtype="float32", device=device, callback=callback):
+        while True:
+            yield blocks.get()
+
+def transcribe_stream(blocks, transcriber, on_event=None):
+    """Drives a transcriber from a block iterator; returns all emitted events."""
+    events = []
+    try:
+        for block in blocks:
+            for event in transcriber.push(block):
+                events.append(event)
+                if on_event:
+                    on_event(event)
+    except KeyboardInterrupt:
+        pass
+    for event in transcriber.finish():
+        events.append(event)
+        if on_event:
+            on_event(event)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chordia live transcription")
+    parser.add_argument("audio", nargs="?", help="file to replay as a stream")
+    parser.add_argument("--mic", action="store_true", help="read from the default microphone")
+    parser.add_argument("--block", type=int, default=1024, help="block size in samples")
+    parser.add_argument("--window", type=float, default=1.0, help="note-tracking window (s)")
+    parser.add_argument("--hop", type=float, default=0.25, help="analysis hop (s)")
+    parser.add_argument("--lookahead", type=int, default=8, help="held-back edge frames")
+    parser.add_argument("--realtime", action="store_true", help="pace file replay at playback speed")
+    args = parser.parse_args()
+    if not args.mic and not args.audio:
+        parser.error("give an audio file or --mic")
+
+    transcriber = StreamingTranscriber(window_seconds=args.window, hop_seconds=args.hop,
+                                       lookahead_frames=args.lookahead)
+    if args.mic:
+        blocks = microphone_blocks(args.block)
+    else:
+        blocks = file_blocks(args.audio, args.block, realtime=args.realtime)
+
+    def show(event):
+        print(f"{event['time']:8.3f}s  {event['type']:<8} {event['note']:<4} vel {event['velocity']}")
+
+    transcribe_stream(blocks, transcriber, on_event=show)
+    report = transcriber.latency_report()
+    print(f"\nblocks={report['blocks']} hops={report['hops']} hop={report['hop_ms']}ms "
+          f"algorithmic={report['algorithmic_ms']}ms")
+    for key in ("latency_ms", "compute_ms"):
+        stats = report[key]
+        print(f"{key:<11} p50={stats['p50']} p95={stats['p95']} max={stats['max']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Transpose, capo and alternate tunings applied to a finished analysis.
+
+Everything here works on the cached results (NoteTable columns, chord segments,
+the Basic Pitch MIDI bytes), so changing key, tuning or capo regenerates the
+guide and exports without running the model again.
+"""
+import re
+import struct
+
+import numpy as np
+
+from note_store import NOTE_NAMES
+
+SHARP_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+FLAT_NAMES = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+PITCH_CLASSES = {name: i for names in (SHARP_NAMES, FLAT_NAMES) for i, name in enumerate(names)}
+# Enharmonic spellings that are in neither list (seen in autochord output and typed labels)
+PITCH_CLASSES.update({"Cb": 11, "Fb": 4, "E#": 5, "B#": 0})
+
+# Open-string MIDI notes, lowest string first
+TUNINGS = {
+    "Standard (EADGBE)": (40, 45, 50, 55, 59, 64),
+    "Drop D (DADGBE)": (38, 45, 50, 55, 59, 64),
+    "Half Step Down (Eb)": (39, 44, 49, 54, 58, 63),
+    "DADGAD": (38, 45, 50, 55, 57, 62),
+    "Open G (DGDGBD)": (38, 43, 50, 55, 59, 62),
+    "Bass (EADG)": (28, 33, 38, 43),
+    "5-String Bass (BEADG)": (23, 28, 33, 38, 43),
+}
+MAX_FRET = 22
+
+_CHORD = re.compile(r"^([A-G][#b]?)(.*?)(?:/([A-G][#b]?))?$")
+
+
+# --- KEY ---
+
+def transpose_name(name, semitones):
+    """Transposes a pitch-class name, keeping flat spelling if the input used it."""
+    names = FLAT_NAMES if "b" in name[1:] else SHARP_NAMES
+    return names[(PITCH_CLASSES[name] + semitones) % 12]
+
+def transpose_chord(label, semitones):
+    """'Am7' +2 -> 'Bm7', 'Bb/D' +1 -> 'B/D#'. Labels that are not chords ('N') are kept."""
+    match = _CHORD.match(label)
+    if not semitones or match is None:
+        return label
+    root, quality, bass = match.groups()
+    out = transpose_name(root, semitones) + quality
+    if bass:
+        out += "/" + transpose_name(bass, semitones)
+    return out
+
+def transpose_chords(chords, semitones):
+    """[(start, end, chord), ...] in another key (each distinct label is parsed once)."""
+    if not semitones:
+        return list(chords)
+    mapping = {label: transpose_chord(label, semitones) for label in {c[2] for c in chords}}
+    return [(start, end, mapping[chord]) for start, end, chord in chords]
+
+def transpose_midi(midi_bytes, semitones):
+    """Shifts every note in a Standard MIDI File; timing, velocities and pitch bends are untouched.
+
+    Works on the raw track bytes (no mido round trip), which keeps re-exports of
+    long transcriptions fast. Notes pushed outside 0-127 are dropped.
+    """
+    if not semitones:
+        return midi_bytes
+    data = memoryview(midi_bytes)
+    out = bytearray()
+    i = 0
+    while i + 8 <= len(data):
+        chunk_type = bytes(data[i:i + 4])
+        length = struct.unpack(">I", data[i + 4:i + 8])[0]
+        body = data[i + 8:i + 8 + length]
+        if chunk_type == b"MTrk":
+            body = _transpose_track(body, semitones)
+        out += chunk_type + struct.pack(">I", len(body)) + body
+        i += 8 + length
+    return bytes(out)
+
+def _read_varlen(data, i):
+    value = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, i
+
+def _varlen(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+def _transpose_track(data, semitones):
+    """Re-encodes one track with explicit status bytes (no running status)."""
+    out = bytearray()
+    i, status, carry = 0, 0, 0
+    while i < len(data):
+        delta, i = _read_varlen(data, i)
+        if data[i] >= 0x80:
+            status = data[i]
+            i += 1
+        if status in (0xF0, 0xF7, 0xFF):
+            # Meta / sysex: copied as is
+            start = i
+            if status == 0xFF:
+                i += 1
+            length, i = _read_varlen(data, i)
+            i += length
+            event = bytes([status]) + bytes(data[start:i])
+        else:
+            size = 1 if status & 0xF0 in (0xC0, 0xD0) else 2
+            event = bytearray([status]) + data[i:i + size]
+            i += size
+            if status & 0xF0 in (0x80, 0x90, 0xA0):
+                note = event[1] + semitones
+                if not 0 <= note <= 127:
+                    carry += delta  # keep later events in place
+                    continue
+                event[1] = note
+        out += _varlen(delta + carry) + event
+        carry = 0
+    return bytes(out)
+
+
+# --- FRETBOARD ---
+
+def string_names(tuning):
+    """Display names for a tuning's strings, lowest first (e.g. 'E2', 'A2', ...)."""
+    return [str(NOTE_NAMES[p]) for p in TUNINGS[tuning]]
+
+def tab_positions(pitch, tuning="Standard (EADGBE)", capo=0, max_fret=MAX_FRET):
+    """Vectorized string/fret lookup for an array of MIDI pitches.
+
+    Like app_v9's midi_to_tab, each note goes on the highest string that can
+    play it (so the lowest fret). Frets are counted from the capo. Returns
+    (string_index, fret) arrays with string 0 the lowest; -1 where unplayable.
+    """
+    open_strings = np.asarray(TUNINGS[tuning], dtype=np.int16) + capo
+    frets = np.asarray(pitch, dtype=np.int16)[:, None] - open_strings[None, :]
+    playable = (frets >= 0) & (frets <= max_fret - capo)
+    # Index of the last (highest) playable string; argmax on the reversed columns
+    string = len(open_strings) - 1 - np.argmax(playable[:, ::-1], axis=1)
+    ok = playable.any(axis=1)
+    string = np.where(ok, string, -1)
+    fret = np.where(ok, frets[np.arange(len(frets)), np.maximum(string, 0)], -1)
+    return string, fret
+
+def tab_labels(pitch, tuning="Standard (EADGBE)", capo=0):
+    """'A2 | Fret: 3' style labels (app_v9's Guitar Tab column) for an array of pitches."""
+    string, fret = tab_positions(pitch, tuning, capo)
+    names = string_names(tuning)
+    return [
+        f"{names[s]} | Fret: {f}" if s >= 0 else "Out of Range"
+        for s, f in zip(string.tolist(), fret.tolist())
+    ]
+
+def midi_to_tab(midi_note, tuning="Standard (EADGBE)", capo=0):
+    """Single-note version of tab_labels."""
+    return tab_labels([midi_note], tuning, capo)[0]